@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, UploadFile, File, Form
 from sqlalchemy.orm import Session
 from typing import List
 import os
@@ -17,7 +17,11 @@ from app.schemas.course import (
     EnrollmentCreate,
     EnrollmentResponse
 )
+from app.models.ingestion import IngestionJob
+from app.schemas.ingestion import IngestionJobResponse
+from app.services.ingestion_service import ingestion_service
 from app.services.rag_service import rag_service
+from app.services.blocking_executor import blocking_executor
 
 router = APIRouter()
 
@@ -238,13 +242,20 @@ async def delete_course(
     try:
         db.delete(course)
         db.commit()
-        return {"message": "Course deleted successfully"}
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete course: {str(e)}"
         )
+    
+    # The course is gone either way; a leftover store only wastes disk
+    try:
+        await blocking_executor.run(rag_service.delete_course_store, course_id)
+    except Exception as e:
+        print(f"Failed to delete vector store of course {course_id}: {str(e)}")
+    
+    return {"message": "Course deleted successfully"}
 
 @router.post("/{course_id}/materials")
 async def upload_course_material(
@@ -287,35 +298,26 @@ async def upload_course_material(
             content = await file.read()
             f.write(content)
         
-        # Create vector store (optional - don't fail upload if this fails)
-        vector_store_id = None
-        try:
-            vector_store_id = await rag_service.create_vector_store(
-                course_id=course_id,
-                file_path=str(file_path),
-                material_title=title
-            )
-        except Exception as e:
-            print(f"Warning: Failed to create vector store: {str(e)}")
-            # Continue anyway - material can be uploaded without vector store
-        
-        # Save material record
+        # Save material record; vector_store_id is filled in once indexing finishes
         material = CourseMaterial(
             course_id=course_id,
             title=title,
             file_path=str(file_path),
-            file_type=file_ext[1:],  # Remove the dot
-            vector_store_id=vector_store_id
+            file_type=file_ext[1:]  # Remove the dot
         )
         
         db.add(material)
         db.commit()
         db.refresh(material)
         
+        # Index in the background - extraction and embedding can take minutes
+        job = ingestion_service.submit(db, course_id=course_id, material_id=material.id)
+        
         return {
-            "message": "Material uploaded successfully",
+            "message": "Material uploaded successfully, indexing in progress",
             "material_id": material.id,
-            "vector_store_id": vector_store_id
+            "job_id": job.id,
+            "status": job.status
         }
     except HTTPException:
         raise
@@ -327,6 +329,80 @@ async def upload_course_material(
             detail=f"Failed to upload material: {str(e)}"
         )
 
+@router.delete("/{course_id}/materials/{material_id}")
+async def delete_course_material(
+    course_id: int,
+    material_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    """Delete course material and remove it from the course's vector store (Teacher/Admin only)"""
+    material = db.query(CourseMaterial).filter(
+        CourseMaterial.id == material_id,
+        CourseMaterial.course_id == course_id
+    ).first()
+    if not material:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Material not found"
+        )
+    
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if current_user.role == "teacher" and course.teacher_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to delete materials from this course"
+        )
+    
+    file_path = material.file_path
+    try:
+        db.query(IngestionJob).filter(IngestionJob.material_id == material_id).delete()
+        db.delete(material)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to delete material: {str(e)}"
+        )
+    
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+    
+    # Tombstoned vectors are excluded from search right away; reclaim them later.
+    # The material is gone either way (e.g. a store not yet migrated can't be updated).
+    try:
+        if await blocking_executor.run(rag_service.remove_material_from_store, course_id, material_id):
+            background_tasks.add_task(blocking_executor.run, rag_service.compact_store, course_id)
+    except Exception as e:
+        print(f"Failed to remove material {material_id} from the vector store of course {course_id}: {str(e)}")
+    
+    return {"message": "Material deleted successfully"}
+
+@router.get("/ingestion-jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(
+    job_id: int,
+    current_user: User = Depends(get_teacher_user),
+    db: Session = Depends(get_db)
+):
+    """Get the indexing status of an uploaded material (Teacher/Admin only)"""
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ingestion job not found"
+        )
+    
+    course = db.query(Course).filter(Course.id == job.course_id).first()
+    if current_user.role == "teacher" and (not course or course.teacher_id != current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this ingestion job"
+        )
+    
+    return IngestionJobResponse.from_orm(job)
+
 @router.post("/enroll", response_model=EnrollmentResponse)
 async def enroll_in_course(
     enrollment_data: EnrollmentCreate,
@@ -1,25 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+import json
 
-from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.database import get_db, SessionLocal
+from app.core.security import get_current_user, get_admin_user
 from app.models.user import User
 from app.models.course import Course, CourseEnrollment
 from app.models.analytics import CourseAnalytics
 from app.schemas.rag import RAGQueryRequest, RAGQueryResponse
 from app.services.rag_service import rag_service
+from app.services.vector_store_cache import vector_store_cache
+from app.services.embedding_cache import embedding_cache
+from app.services.answer_cache import answer_cache
+from app.services.generation_cache import generation_cache
+from app.services.blocking_executor import blocking_executor
+from app.services.ollama_service import ollama_service
+from app.services.llm_metrics import llm_metrics
 
 router = APIRouter()
 
-@router.post("/query", response_model=RAGQueryResponse)
-async def query_rag(
-    request: RAGQueryRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Query the RAG system for course-specific questions"""
-    # Check course access
-    course = db.query(Course).filter(Course.id == request.course_id).first()
+def _check_course_access(course_id: int, current_user: User, db: Session) -> Course:
+    """Ensure the user may query the course's AI co-instructor"""
+    course = db.query(Course).filter(Course.id == course_id).first()
     if not course:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -29,7 +32,7 @@ async def query_rag(
     # Check enrollment for students
     if current_user.role == "student":
         enrollment = db.query(CourseEnrollment).filter(
-            CourseEnrollment.course_id == request.course_id,
+            CourseEnrollment.course_id == course_id,
             CourseEnrollment.student_id == current_user.id
         ).first()
         if not enrollment:
@@ -44,6 +47,33 @@ async def query_rag(
             detail="Not authorized to query this course"
         )
     
+    return course
+
+def _record_ai_interaction(course_id: int, db: Session):
+    analytics = db.query(CourseAnalytics).filter(
+        CourseAnalytics.course_id == course_id
+    ).first()
+    if analytics:
+        analytics.ai_interactions += 1
+        db.commit()
+
+def _record_streamed_interaction(course_id: int):
+    # The request's session may already be closed while the response streams
+    db = SessionLocal()
+    try:
+        _record_ai_interaction(course_id, db)
+    finally:
+        db.close()
+
+@router.post("/query", response_model=RAGQueryResponse)
+async def query_rag(
+    request: RAGQueryRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Query the RAG system for course-specific questions"""
+    _check_course_access(request.course_id, current_user, db)
+    
     # Query RAG system
     result = await rag_service.query(
         query=request.query,
@@ -52,16 +82,55 @@ async def query_rag(
         material_ids=request.material_ids
     )
     
-    # Update analytics
-    analytics = db.query(CourseAnalytics).filter(
-        CourseAnalytics.course_id == request.course_id
-    ).first()
-    if analytics:
-        analytics.ai_interactions += 1
-        db.commit()
+    # Update analytics; failures raise before this, so only answered queries count
+    if result["answer"]:
+        _record_ai_interaction(request.course_id, db)
     
     return RAGQueryResponse(**result)
 
+@router.post("/query/stream")
+async def query_rag_stream(
+    request: RAGQueryRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Query the RAG system and stream the answer as server-sent events.
+    
+    Events: "sources" first, then "token" for each piece of the answer, and
+    finally "done" - or "moderation" if the answer is cut off by moderation, or
+    "error" if it breaks off (e.g. Ollama fails mid-answer).
+    """
+    _check_course_access(request.course_id, current_user, db)
+    course_id = request.course_id
+    
+    events = rag_service.query_stream(
+        query=request.query,
+        course_id=request.course_id,
+        conversation_history=request.conversation_history,
+        material_ids=request.material_ids
+    )
+    # Produce the first event before responding, so overload surfaces as a 429/503 status
+    first_event = await events.__anext__()
+    
+    async def event_stream():
+        try:
+            event, data = first_event
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            async for event, data in events:
+                # Count the interaction once the answer is complete; "error" ends a failed one
+                if event in ("done", "moderation"):
+                    await blocking_executor.run(_record_streamed_interaction, course_id)
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            # Release the LLM slot promptly if the client disconnects
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/health")
 async def check_rag_health():
     """Check RAG system health"""
@@ -70,3 +139,76 @@ async def check_rag_health():
         "ollama": "connected",
         "vector_store": "ready"
     }
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get vector store, embedding, answer and generation cache statistics (Admin only)"""
+    return {
+        "vector_store_cache": vector_store_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "generation_cache": generation_cache.stats()
+    }
+
+@router.get("/index/{course_id}")
+async def get_vector_index_info(
+    course_id: int,
+    current_user: User = Depends(get_admin_user)
+):
+    """Get the vector index type, size and measured recall for a course (Admin only)"""
+    try:
+        return await blocking_executor.run(rag_service.describe_vector_store, course_id)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No vector store for this course"
+        )
+
+@router.get("/executor/stats")
+async def get_executor_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get queue depth and throughput of the blocking-work pools and retrieval batchers (Admin only)"""
+    return {
+        **blocking_executor.stats(),
+        "embed_batches": rag_service.embed_batcher.stats(),
+        "search_batches": rag_service.search_batcher.stats()
+    }
+
+@router.get("/ollama/pool")
+async def get_ollama_pool_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get connection pool usage of the shared Ollama client (Admin only)"""
+    return ollama_service.pool_stats()
+
+@router.get("/ollama/scheduler")
+async def get_ollama_scheduler_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get per-priority-class queue depth, wait times and rejections for Ollama calls (Admin only)"""
+    return ollama_service.scheduler.stats()
+
+@router.get("/ollama/single-flight")
+async def get_ollama_single_flight_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get how many identical concurrent Ollama requests shared an upstream call (Admin only)"""
+    return ollama_service.single_flight.stats()
+
+@router.get("/ollama/backends")
+async def get_ollama_backend_stats(
+    current_user: User = Depends(get_admin_user)
+):
+    """Get health, weight and outstanding requests of each Ollama backend (Admin only)"""
+    return ollama_service.backend_stats()
+
+@router.get("/ollama/metrics")
+async def get_ollama_metrics(
+    minutes: int = None,
+    current_user: User = Depends(get_admin_user)
+):
+    """Get token counts, timings and tokens per second of Ollama calls by operation and caller (Admin only)"""
+    return llm_metrics.summary(minutes)
@@ -18,8 +18,42 @@ class Settings(BaseSettings):
     
     # Ollama
     OLLAMA_BASE_URL: str = "http://localhost:11434"
+    # Backends as URLs or {"url": ..., "weight": ...}; empty means OLLAMA_BASE_URL only
+    OLLAMA_CHAT_BACKENDS: list = []  # generate and chat
+    OLLAMA_EMBED_BACKENDS: list = []  # embeddings
+    OLLAMA_BACKEND_FAILURE_THRESHOLD: int = 3  # consecutive failures before a backend leaves rotation
+    OLLAMA_HEALTH_CHECK_INTERVAL: float = 10.0  # seconds between health probes; 0 disables them
+    # Circuit breaker per pool (chat, embed): fail fast while Ollama is down instead of waiting for timeouts
+    OLLAMA_CIRCUIT_FAILURE_RATE: float = 0.5  # of the recent calls, to open the circuit
+    OLLAMA_CIRCUIT_WINDOW: int = 20  # recent calls considered
+    OLLAMA_CIRCUIT_MIN_CALLS: int = 5
+    OLLAMA_CIRCUIT_OPEN_SECONDS: float = 10.0  # first cool-down; doubles while trial calls keep failing
+    OLLAMA_CIRCUIT_MAX_OPEN_SECONDS: float = 120.0
+    OLLAMA_CIRCUIT_HALF_OPEN_CALLS: int = 1  # trial calls let through after a cool-down
+    OLLAMA_RETRY_BUDGET_RATIO: float = 0.1  # retries earned per call
     OLLAMA_MODEL: str = "llama3.2"
     OLLAMA_EMBEDDING_MODEL: str = "nomic-embed-text"
+    OLLAMA_EMBED_BATCH_SIZE: int = 32
+    OLLAMA_EMBED_CONCURRENCY: int = 4
+    OLLAMA_EMBED_MAX_RETRIES: int = 3
+    OLLAMA_KEEP_ALIVE: str = "30m"  # how long Ollama keeps models loaded after a request
+    OLLAMA_MAX_CONNECTIONS: int = 32
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = 16
+    OLLAMA_KEEPALIVE_EXPIRY: float = 30.0  # seconds an idle connection stays open
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0
+    OLLAMA_GENERATE_TIMEOUT: float = 120.0  # generate and chat, including streaming
+    OLLAMA_EMBED_TIMEOUT: float = 60.0
+    OLLAMA_LOAD_TIMEOUT: float = 300.0  # loading a model during warm-up
+    # Admission control: lower priority value is served first; max_wait in seconds
+    OLLAMA_MAX_CONCURRENT_REQUESTS: int = 8  # across all priority classes
+    OLLAMA_PRIORITY_CLASSES: dict = {
+        "interactive": {"priority": 0, "max_concurrency": 6, "max_queue": 200, "max_wait": 15.0},  # student chat
+        "generation": {"priority": 1, "max_concurrency": 2, "max_queue": 20, "max_wait": 60.0},  # quizzes
+        "bulk": {"priority": 2, "max_concurrency": 2, "max_queue": 100, "max_wait": 300.0}  # ingestion
+    }
+    OLLAMA_SINGLE_FLIGHT: bool = True  # share one upstream call between identical concurrent requests
+    OLLAMA_SINGLE_FLIGHT_MAX_TEMPERATURE: float = 0.0  # generate/chat above this are sampled, never shared
+    LLM_METRICS_WINDOW_MINUTES: int = 60  # per-minute token and timing history kept in memory
     
     # File Upload
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
@@ -29,6 +63,59 @@ class Settings(BaseSettings):
     VECTOR_STORE_PATH: str = "vector_stores"
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
+    VECTOR_STORE_CACHE_MAX_ENTRIES: int = 256
+    VECTOR_STORE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # 512MB
+    VECTOR_INDEX_TYPE: str = "auto"  # auto, flat, hnsw, ivf
+    VECTOR_INDEX_FLAT_MAX: int = 10000  # auto: exact search up to this many vectors
+    VECTOR_INDEX_HNSW_MAX: int = 200000  # auto: HNSW up to this many, IVF beyond
+    VECTOR_INDEX_HNSW_M: int = 32
+    VECTOR_INDEX_HNSW_EF_CONSTRUCTION: int = 40
+    VECTOR_INDEX_HNSW_EF_SEARCH: int = 64
+    VECTOR_INDEX_IVF_NPROBE: int = 16
+    VECTOR_COMPRESSION: str = "none"  # none, fp16, sq8, pq
+    VECTOR_PQ_M: int = 64  # PQ sub-quantizers; must divide the (reduced) dimension
+    VECTOR_PCA_DIM: int = 0  # 0 disables PCA reduction
+    VECTOR_STORE_COMPACTION_DEAD_RATIO: float = 0.2  # compact once this share of vectors is tombstoned
+    CHUNK_STORE_COMPRESSION: bool = False  # zlib-compress chunk text per block
+    CHUNK_STORE_BLOCK_ROWS: int = 64
+    EMBEDDING_CACHE_PATH: str = "vector_stores/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 1GB
+    GENERATION_CACHE_ENABLED: bool = True  # cache deterministic (temperature 0) or explicitly cacheable generations
+    GENERATION_CACHE_PATH: str = "vector_stores/generation_cache.sqlite3"
+    GENERATION_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # 256MB
+
+    # Context assembly
+    RAG_CONTEXT_TOKEN_BUDGET: int = 1024  # chat prompt tokens: instructions, question, context and history
+    RAG_HISTORY_MAX_SHARE: float = 0.3  # of the budget left after instructions and question
+    RAG_RETRIEVAL_CANDIDATES: int = 8  # chunks retrieved before MMR and packing
+    RAG_MMR_LAMBDA: float = 0.7  # 1.0 ranks by relevance only, lower values favour diversity
+    QUIZ_CONTEXT_TOKEN_BUDGET: int = 2048
+    CONTEXT_TOKEN_ENCODING: str = "cl100k_base"
+    
+    # Answer cache
+    ANSWER_CACHE_MAX_ENTRIES: int = 2000
+    ANSWER_CACHE_TTL_SECONDS: int = 6 * 60 * 60  # 6 hours
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95  # cosine similarity of query embeddings
+    
+    # Ingestion
+    INGESTION_WORKERS: int = 2
+    INGESTION_MAX_ATTEMPTS: int = 3
+    INGESTION_LEASE_SECONDS: int = 60  # a running job whose owner stops renewing this is picked up again
+    INGESTION_PROGRESS_INTERVAL: float = 2.0  # seconds between progress writes (each also renews the lease)
+    
+    # Blocking work (FAISS, file I/O, document parsing) runs outside the event loop
+    BLOCKING_IO_THREADS: int = 8
+    DOCUMENT_PARSE_PROCESSES: int = 2  # 0 parses in the I/O thread pool instead
+    DOCUMENT_PARSE_PAGES_PER_TASK: int = 16
+    
+    # Startup warm-up
+    WARMUP_ENABLED: bool = True
+    WARMUP_COURSES: int = 20  # preload indexes of the courses with the most AI interactions
+    
+    # Retrieval micro-batching: concurrent queries are embedded and searched together
+    RETRIEVAL_BATCH_WINDOW_MS: float = 5.0  # 0 disables waiting for more queries
+    RETRIEVAL_BATCH_MAX_SIZE: int = 32
+    RETRIEVAL_EMBED_MAX_RETRIES: int = 1  # query embeddings; ingestion uses OLLAMA_EMBED_MAX_RETRIES
     
     # Moderation
     MODERATION_THRESHOLD: float = 0.7
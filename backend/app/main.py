@@ -1,4 +1,6 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
@@ -6,16 +8,36 @@ import os
 from app.core.config import settings
 from app.core.database import engine, Base
 from app.api import auth, users, courses, quiz, analytics, rag, moderation, assignments
+from app.services.ingestion_service import ingestion_service
+from app.services.blocking_executor import blocking_executor
+from app.services.warmup_service import warmup_service
+from app.services.ollama_service import ollama_service
+from app.services.admission_scheduler import OverloadedError
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Ollama client per process, reused by every request
+    await ollama_service.start()
+    # Start background material indexing (resumes unfinished jobs)
+    await ingestion_service.start()
+    # Preload hot indexes and Ollama models in the background; /health/ready reports when done
+    warmup_service.start()
+    yield
+    await warmup_service.stop()
+    await ingestion_service.stop()
+    blocking_executor.shutdown()
+    await ollama_service.close()
+
 app = FastAPI(
     title="LEARNLY API",
     description="Virtual AI Co-Instructor Platform API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -33,6 +55,15 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """Shed load with 429 (queue full) or 503 (queued too long, circuit open) instead of waiting for timeouts"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("vector_stores", exist_ok=True)
@@ -65,3 +96,13 @@ async def health_check():
         "database": "connected",
         "ollama": "ready"
     }
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Ready once startup warm-up has finished; 503 until then"""
+    if not warmup_service.ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "warming_up", "warmup": warmup_service.status}
+        )
+    return {"status": "ready", "warmup": warmup_service.status}
@@ -4,6 +4,7 @@ from app.models.quiz import Quiz, QuizQuestion, QuizAttempt, QuizAnswer
 from app.models.analytics import UserAnalytics, CourseAnalytics
 from app.models.moderation import ModerationLog, ModerationSettings
 from app.models.assignment import Assignment, AssignmentSubmission
+from app.models.ingestion import IngestionJob
 
 __all__ = [
     "User",
@@ -20,4 +21,5 @@ __all__ = [
     "ModerationSettings",
     "Assignment",
     "AssignmentSubmission",
+    "IngestionJob",
 ]
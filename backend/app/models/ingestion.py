@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from datetime import datetime
+
+from app.core.database import Base
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"), nullable=False, index=True)
+    material_id = Column(Integer, ForeignKey("course_materials.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, running, completed, failed
+    stage = Column(String, nullable=True)  # extract, embed, index
+    progress = Column(Integer, default=0)  # 0-100
+    total_chunks = Column(Integer, default=0)
+    embedded_chunks = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    owner = Column(String, nullable=True)  # process running the job
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+class IngestionJobResponse(BaseModel):
+    id: int
+    course_id: int
+    material_id: int
+    status: str
+    stage: Optional[str] = None
+    progress: int
+    total_chunks: int
+    embedded_chunks: int
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+class OverloadedError(Exception):
+    """Raised when a request can't be admitted; mapped to an HTTP error by the app"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+class AdmissionScheduler:
+    """Priority-aware admission control for calls to a shared backend.
+
+    Every request belongs to a priority class with its own concurrency limit,
+    queue length and maximum queueing time; all classes also share a total
+    concurrency limit. A freed slot goes to the highest-priority class that
+    is waiting and below its own limit, and new requests never overtake
+    waiting ones of equal or higher priority that could take the slot. A
+    full queue is rejected at once with 429; a request still queued at its
+    deadline fails with 503.
+    """
+
+    def __init__(self, classes: Dict[str, Dict], max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.classes = {
+            name: {
+                "priority": config["priority"],
+                "max_concurrency": config["max_concurrency"],
+                "max_queue": config["max_queue"],
+                "max_wait": config["max_wait"]
+            }
+            for name, config in classes.items()
+        }
+        self._order = sorted(self.classes, key=lambda name: self.classes[name]["priority"])
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in self.classes}
+        self._active = {name: 0 for name in self.classes}
+        self._metrics = {
+            name: {"admitted": 0, "rejected": 0, "timed_out": 0, "wait_seconds_total": 0.0, "max_wait_seconds": 0.0}
+            for name in self.classes
+        }
+
+    def _has_capacity(self, name: str) -> bool:
+        return (
+            self._active[name] < self.classes[name]["max_concurrency"]
+            and sum(self._active.values()) < self.max_concurrency
+        )
+
+    def _can_admit(self, name: str) -> bool:
+        priority = self.classes[name]["priority"]
+        # A higher class held back by its own limit can't use the slot, so it doesn't block this one
+        waiting_ahead = any(
+            self._waiters[other]
+            for other in self._order
+            if other == name or (
+                self.classes[other]["priority"] <= priority
+                and self._active[other] < self.classes[other]["max_concurrency"]
+            )
+        )
+        return not waiting_ahead and self._has_capacity(name)
+
+    def _admit(self, name: str, waited: float):
+        self._active[name] += 1
+        metrics = self._metrics[name]
+        metrics["admitted"] += 1
+        metrics["wait_seconds_total"] += waited
+        metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], waited)
+
+    def _dispatch(self):
+        """Hand free slots to waiters, highest priority first"""
+        for name in self._order:
+            waiters = self._waiters[name]
+            while waiters and self._has_capacity(name):
+                future = waiters.popleft()
+                if not future.done():
+                    self._active[name] += 1
+                    future.set_result(True)
+
+    async def acquire(self, name: str):
+        if name not in self.classes:
+            raise ValueError(f"Unknown priority class: {name}")
+        config = self.classes[name]
+        if self._can_admit(name):
+            self._admit(name, 0.0)
+            return
+
+        if len(self._waiters[name]) >= config["max_queue"]:
+            self._metrics[name]["rejected"] += 1
+            raise OverloadedError(429, f"Too many pending {name} requests, please retry shortly", retry_after=1)
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[name].append(future)
+        try:
+            await asyncio.wait({future}, timeout=config["max_wait"])
+        except BaseException:
+            # Cancelled while queued: give back a slot that was handed over meanwhile
+            self._leave_queue(name, future)
+            raise
+        if not future.done():
+            self._leave_queue(name, future)
+            self._metrics[name]["timed_out"] += 1
+            raise OverloadedError(
+                503,
+                f"The AI service is busy; {name} request not started within {config['max_wait']:.0f}s",
+                retry_after=max(1, int(config["max_wait"] / 4))
+            )
+
+        # _dispatch already counted the slot as active
+        self._active[name] -= 1
+        self._admit(name, time.monotonic() - started)
+
+    def _leave_queue(self, name: str, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            self._active[name] -= 1
+            self._dispatch()
+            return
+        future.cancel()
+        try:
+            self._waiters[name].remove(future)
+        except ValueError:
+            pass
+
+    def release(self, name: str):
+        self._active[name] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def stats(self) -> Dict:
+        result = {"max_concurrency": self.max_concurrency, "active": sum(self._active.values()), "classes": {}}
+        for name in self._order:
+            metrics = self._metrics[name]
+            result["classes"][name] = {
+                **self.classes[name],
+                **metrics,
+                "active": self._active[name],
+                "queued": sum(1 for future in self._waiters[name] if not future.done()),
+                "avg_wait_seconds": metrics["wait_seconds_total"] / metrics["admitted"] if metrics["admitted"] else 0.0
+            }
+        return result
@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+class AnswerCache:
+    """LRU + TTL cache of RAG answers keyed by (course_id, material_ids, query).
+
+    Lookups first try the normalized query text, then fall back to the most
+    similar cached query embedding for the same course and material selection,
+    scored in one matrix product against the scope's stacked embeddings.
+    Each entry records the version of the course store it was answered from,
+    so answers are dropped as soon as the course's materials change, even if
+    the change happened in another worker.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        # Keys per (course_id, material_ids) scope, and their embeddings stacked into a unit-row matrix
+        self._scope_keys: Dict[Tuple, Dict[Tuple, None]] = {}
+        self._matrices: Dict[Tuple, Tuple[List[Tuple], np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.time_saved_seconds = 0.0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        query = re.sub(r"\s+", " ", query.lower()).strip()
+        return query.strip(" ?!.,;:")
+
+    @staticmethod
+    def _scope(course_id: int, material_ids: Optional[List[int]]) -> Tuple:
+        return (course_id, tuple(sorted(set(material_ids or []))))
+
+    def get_exact(self, course_id: int, material_ids: Optional[List[int]], query: str, store_version) -> Optional[Dict]:
+        key = (*self._scope(course_id, material_ids), self.normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh(key, entry, store_version):
+                return None
+            self._entries.move_to_end(key)
+            return self._hit(entry, semantic=False)
+
+    def get_similar(
+        self,
+        course_id: int,
+        material_ids: Optional[List[int]],
+        query_embedding: List[float],
+        store_version
+    ) -> Optional[Dict]:
+        """Return the answer of the most similar cached query above the threshold, counting a miss otherwise"""
+        scope = self._scope(course_id, material_ids)
+        vector = self._unit(query_embedding)
+        with self._lock:
+            keys, matrix = self._matrix(scope)
+            scores = matrix @ vector if keys else np.zeros(0, dtype="float32")
+            candidates = np.flatnonzero(scores >= self.similarity_threshold)
+            # Best first; stale entries are dropped as they come up
+            for row in candidates[np.argsort(-scores[candidates])]:
+                key = keys[row]
+                if self._is_fresh(key, self._entries[key], store_version):
+                    self._entries.move_to_end(key)
+                    return self._hit(self._entries[key], semantic=True)
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        course_id: int,
+        material_ids: Optional[List[int]],
+        query: str,
+        query_embedding: List[float],
+        store_version,
+        response: Dict,
+        latency_seconds: float
+    ):
+        key = (*self._scope(course_id, material_ids), self.normalize_query(query))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "response": response,
+                "embedding": self._unit(query_embedding),
+                "store_version": store_version,
+                "created_at": time.monotonic(),
+                "latency": latency_seconds
+            }
+            self._scope_keys.setdefault(key[:2], {})[key] = None
+            self._matrices.pop(key[:2], None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_course(self, course_id: int):
+        with self._lock:
+            for scope in [scope for scope in self._scope_keys if scope[0] == course_id]:
+                for key in list(self._scope_keys[scope]):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups > 0 else 0.0,
+                "time_saved_seconds": round(self.time_saved_seconds, 3)
+            }
+
+    def _is_fresh(self, key: Tuple, entry: Dict, store_version) -> bool:
+        if entry["store_version"] != store_version or time.monotonic() - entry["created_at"] > self.ttl_seconds:
+            self._remove(key)
+            self.invalidations += 1
+            return False
+        return True
+
+    def _remove(self, key: Tuple):
+        del self._entries[key]
+        scope = key[:2]
+        keys = self._scope_keys[scope]
+        del keys[key]
+        if not keys:
+            del self._scope_keys[scope]
+        self._matrices.pop(scope, None)
+
+    def _matrix(self, scope: Tuple) -> Tuple[List[Tuple], np.ndarray]:
+        """The scope's keys and stacked embeddings, rebuilt only after the scope changed"""
+        if scope not in self._matrices:
+            keys = list(self._scope_keys.get(scope, ()))
+            matrix = np.stack([self._entries[key]["embedding"] for key in keys]) if keys else None
+            self._matrices[scope] = (keys, matrix)
+        return self._matrices[scope]
+
+    def _hit(self, entry: Dict, semantic: bool) -> Dict:
+        if semantic:
+            self.semantic_hits += 1
+        else:
+            self.exact_hits += 1
+        self.time_saved_seconds += entry["latency"]
+        return entry["response"]
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+)
@@ -0,0 +1,98 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Union
+
+import httpx
+
+class Backend:
+    def __init__(self, url: str, weight: float):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.unhealthy_since: Optional[float] = None
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error
+        }
+
+class BackendPool:
+    """Routes requests across equivalent Ollama hosts.
+
+    Each request goes to the healthy backend with the fewest outstanding
+    requests relative to its weight. A backend that fails failure_threshold
+    requests in a row (connection errors, timeouts, 5xx) is taken out of
+    rotation until a health probe or a request succeeds again. If every
+    backend is unhealthy, requests still go to all of them rather than none.
+    """
+
+    def __init__(self, name: str, backends: Iterable[Union[str, Dict]], failure_threshold: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backends: List[Backend] = []
+        for backend in backends:
+            if isinstance(backend, str):
+                backend = {"url": backend}
+            self.backends.append(Backend(backend["url"], float(backend.get("weight", 1.0))))
+        if not self.backends:
+            raise ValueError(f"No Ollama backends configured for the {name} pool")
+
+    def pick(self, exclude: Iterable[str] = ()) -> Backend:
+        candidates = [backend for backend in self.backends if backend.url not in exclude] or self.backends
+        healthy = [backend for backend in candidates if backend.healthy] or candidates
+        # Least outstanding per unit of weight; ties go to the heavier backend
+        return min(healthy, key=lambda backend: ((backend.outstanding + 1) / backend.weight, -backend.weight))
+
+    @asynccontextmanager
+    async def track(self, backend: Backend):
+        """Count a request as outstanding on backend; transport errors count as failures"""
+        backend.outstanding += 1
+        backend.requests += 1
+        try:
+            yield
+        except httpx.TransportError as e:
+            self.record_failure(backend, f"{type(e).__name__}: {str(e)}")
+            raise
+        finally:
+            backend.outstanding -= 1
+
+    def record_response(self, backend: Backend, response: httpx.Response):
+        if response.status_code >= 500:
+            self.record_failure(backend, f"HTTP {response.status_code}")
+        else:
+            self.record_success(backend)
+
+    def record_success(self, backend: Backend):
+        backend.consecutive_failures = 0
+        if not backend.healthy:
+            print(f"Ollama backend {backend.url} ({self.name}) is healthy again")
+            backend.healthy = True
+            backend.unhealthy_since = None
+
+    def record_failure(self, backend: Backend, error: str):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = error
+        if backend.healthy and backend.consecutive_failures >= self.failure_threshold:
+            print(f"Ollama backend {backend.url} ({self.name}) marked unhealthy: {error}")
+            backend.healthy = False
+            backend.unhealthy_since = time.time()
+
+    def stats(self) -> Dict:
+        return {
+            "healthy": sum(1 for backend in self.backends if backend.healthy),
+            "total": len(self.backends),
+            "backends": [backend.stats() for backend in self.backends]
+        }
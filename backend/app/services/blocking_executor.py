@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+
+from app.core.config import settings
+
+class BlockingExecutor:
+    """Runs blocking work off the event loop.
+
+    FAISS calls and file / SQLite I/O go to a thread pool (FAISS releases the
+    GIL while it searches). CPU-bound document parsing goes to a process pool,
+    so a large PDF can't hold the GIL while chat requests wait. Both pools are
+    bounded and count in-flight and queued tasks.
+    """
+
+    def __init__(self, io_threads: int, parse_processes: int):
+        self.io_threads = io_threads
+        self.parse_processes = parse_processes
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters = {
+            pool: {"submitted": 0, "in_flight": 0, "peak_queued": 0, "completed": 0, "failed": 0}
+            for pool in ("io", "parse")
+        }
+
+    def _get_io_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._io_pool is None:
+                self._io_pool = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix="rag-io")
+            return self._io_pool
+
+    def _get_parse_pool(self) -> Executor:
+        if self.parse_processes <= 0:
+            return self._get_io_pool()
+        with self._lock:
+            if self._parse_pool is None:
+                # spawn: forking a process that runs threads (event loop, SQLite, FAISS) can deadlock
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_processes,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._parse_pool
+
+    def _track(self, pool: str, workers: int, future: Future) -> Future:
+        counters = self._counters[pool]
+        with self._lock:
+            counters["submitted"] += 1
+            counters["in_flight"] += 1
+            counters["peak_queued"] = max(counters["peak_queued"], counters["in_flight"] - workers)
+
+        def done(f: Future):
+            with self._lock:
+                counters["in_flight"] -= 1
+                counters["failed" if f.cancelled() or f.exception() is not None else "completed"] += 1
+
+        future.add_done_callback(done)
+        return future
+
+    def submit_io(self, func: Callable, *args, **kwargs) -> Future:
+        return self._track("io", self.io_threads, self._get_io_pool().submit(func, *args, **kwargs))
+
+    def submit_parse(self, func: Callable, *args) -> Future:
+        """Run a picklable, module-level function in the parsing process pool"""
+        workers = self.parse_processes if self.parse_processes > 0 else self.io_threads
+        return self._track("parse", workers, self._get_parse_pool().submit(func, *args))
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Await func(*args, **kwargs) running in the I/O thread pool"""
+        return await asyncio.wrap_future(self.submit_io(partial(func, *args, **kwargs)))
+
+    async def run_parse(self, func: Callable, *args):
+        return await asyncio.wrap_future(self.submit_parse(func, *args))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            result = {}
+            for pool, workers in (("io", self.io_threads), ("parse", self.parse_processes)):
+                counters = self._counters[pool]
+                result[pool] = {
+                    **counters,
+                    "workers": workers,
+                    "queued": max(0, counters["in_flight"] - (workers or self.io_threads))
+                }
+            return result
+
+    def shutdown(self):
+        with self._lock:
+            pools = [self._io_pool, self._parse_pool]
+            self._io_pool = None
+            self._parse_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+blocking_executor = BlockingExecutor(
+    io_threads=settings.BLOCKING_IO_THREADS,
+    parse_processes=settings.DOCUMENT_PARSE_PROCESSES
+)
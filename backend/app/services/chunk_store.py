@@ -0,0 +1,164 @@
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Header: magic, flags, rows per block, number of chunks, number of blocks
+HEADER_FORMAT = "<4sIIQQ"
+HEADER_SIZE = 32  # struct size padded so the offset arrays are 8-byte aligned
+MAGIC = b"LCS1"
+FLAG_ZLIB = 1
+
+class ChunkStore:
+    """Read-only, memory-mapped columnar store of chunk text.
+
+    Layout after the header:
+      uncompressed: uint64 offsets[n + 1] followed by the UTF-8 blob
+      compressed:   uint64 block_offsets[b + 1] followed by zlib blocks, each
+                    holding uint32 offsets[k + 1] and the UTF-8 bytes of k chunks
+
+    Offsets are relative to the start of the data region. Reading a chunk only
+    touches the pages (or the single block) that contain it; nothing is
+    deserialized up front, and the OS page cache is shared between workers.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, flags, rows_per_block, num_chunks, num_blocks = struct.unpack_from(
+            HEADER_FORMAT, self._mmap, 0
+        )
+        if magic != MAGIC:
+            raise ValueError(f"Not a chunk store: {self.path}")
+        self.compressed = bool(flags & FLAG_ZLIB)
+        self.rows_per_block = rows_per_block
+        self.num_chunks = num_chunks
+        count = (num_blocks if self.compressed else num_chunks) + 1
+        self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=HEADER_SIZE)
+        self._data_start = HEADER_SIZE + 8 * count
+
+    def __len__(self) -> int:
+        return self.num_chunks
+
+    def get(self, row: int) -> str:
+        if row < 0 or row >= self.num_chunks:
+            raise IndexError(row)
+        if not self.compressed:
+            start = self._data_start + int(self._offsets[row])
+            end = self._data_start + int(self._offsets[row + 1])
+            return self._mmap[start:end].decode("utf-8")
+        block_no, position = divmod(row, self.rows_per_block)
+        block = self._read_block(block_no)
+        inner = np.frombuffer(block, dtype="<u4", count=position + 2)
+        header = 4 * (self._block_rows(block_no) + 1)
+        return block[header + int(inner[position]):header + int(inner[position + 1])].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        if not self.compressed:
+            for row in range(self.num_chunks):
+                yield self.get(row)
+            return
+        for block_no in range(len(self._offsets) - 1):
+            block = self._read_block(block_no)
+            rows = self._block_rows(block_no)
+            inner = np.frombuffer(block, dtype="<u4", count=rows + 1)
+            header = 4 * (rows + 1)
+            for position in range(rows):
+                yield block[header + int(inner[position]):header + int(inner[position + 1])].decode("utf-8")
+
+    def resident_size(self) -> int:
+        """Bytes held outside the page cache (the offsets array)"""
+        return self._offsets.nbytes
+
+    def _block_rows(self, block_no: int) -> int:
+        return min(self.rows_per_block, self.num_chunks - block_no * self.rows_per_block)
+
+    def _read_block(self, block_no: int) -> bytes:
+        start = self._data_start + int(self._offsets[block_no])
+        end = self._data_start + int(self._offsets[block_no + 1])
+        return zlib.decompress(self._mmap[start:end])
+
+    @staticmethod
+    def write(path: Path, chunks: Iterable[str], compress: bool = False, rows_per_block: int = 64) -> int:
+        """Write chunks to a new store file; returns the number of chunks"""
+        writer = ChunkStoreWriter(path, compress=compress, rows_per_block=rows_per_block)
+        try:
+            for chunk in chunks:
+                writer.add(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+class ChunkStoreWriter:
+    """Builds a chunk store incrementally, so its text is never held in memory whole.
+
+    Payloads are spilled to a temporary file as chunks arrive; close() writes
+    the header and offsets, then copies the payloads in after them.
+    """
+
+    def __init__(self, path: Path, compress: bool = False, rows_per_block: int = 64):
+        self.path = Path(path)
+        self.compress = compress
+        self.rows_per_block = rows_per_block
+        self.num_chunks = 0
+        self._spill = tempfile.TemporaryFile(dir=self.path.parent)
+        self._sizes = array("Q")
+        self._block = []
+
+    def add(self, chunk: str):
+        encoded = chunk.encode("utf-8")
+        self.num_chunks += 1
+        if not self.compress:
+            self._spill.write(encoded)
+            self._sizes.append(len(encoded))
+            return
+        self._block.append(encoded)
+        if len(self._block) == self.rows_per_block:
+            self._flush_block()
+
+    def _flush_block(self):
+        inner = np.zeros(len(self._block) + 1, dtype="<u4")
+        inner[1:] = np.cumsum([len(row) for row in self._block])
+        payload = zlib.compress(inner.tobytes() + b"".join(self._block))
+        self._spill.write(payload)
+        self._sizes.append(len(payload))
+        self._block = []
+
+    def close(self) -> int:
+        """Write the store file; returns the number of chunks"""
+        if self._block:
+            self._flush_block()
+        offsets = np.zeros(len(self._sizes) + 1, dtype="<u8")
+        offsets[1:] = np.cumsum(np.frombuffer(self._sizes, dtype="u8"))
+
+        try:
+            with open(self.path, "wb") as f:
+                header = struct.pack(
+                    HEADER_FORMAT,
+                    MAGIC,
+                    FLAG_ZLIB if self.compress else 0,
+                    self.rows_per_block,
+                    self.num_chunks,
+                    len(self._sizes) if self.compress else 0
+                )
+                f.write(header.ljust(HEADER_SIZE, b"\0"))
+                f.write(offsets.tobytes())
+                self._spill.seek(0)
+                shutil.copyfileobj(self._spill, f)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            self._spill.close()
+        return self.num_chunks
+
+    def abort(self):
+        self._spill.close()
@@ -0,0 +1,136 @@
+import math
+import random
+import time
+from collections import deque
+from typing import Dict
+
+from app.services.admission_scheduler import OverloadedError
+
+# Most retries the budget can save up
+RETRY_BUDGET_CAP = 10.0
+
+class CircuitOpenError(OverloadedError):
+    """Raised without calling Ollama while its circuit is open; the app maps it to 503"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(503, f"The AI service ({name}) is temporarily unavailable, please retry shortly", retry_after)
+
+class CircuitBreaker:
+    """Stops sending requests to a backend that keeps failing.
+
+    Closed: calls go through and their outcomes fill a window of the most
+    recent window_size calls; once at least min_calls are in it and the
+    failure rate reaches failure_rate, the circuit opens. Open: calls fail
+    at once with CircuitOpenError for a jittered cool-down that doubles (up
+    to max_open_seconds) each time it reopens. Half-open: after the cool-down
+    up to half_open_calls trial calls go through; a success closes the
+    circuit, a failure opens it again.
+
+    Retries draw on a budget that earns retry_ratio of a retry per call, so
+    retries can't multiply the load on a struggling backend.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        window_size: int,
+        min_calls: int,
+        open_seconds: float,
+        max_open_seconds: float,
+        half_open_calls: int,
+        retry_ratio: float
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_calls = half_open_calls
+        self.retry_ratio = retry_ratio
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window_size)  # True for a failed call
+        self._reopen_at = 0.0
+        self._opened_times = 0
+        self._trials = 0
+        # Start full so a fresh process can ride out a blip
+        self._retry_tokens = RETRY_BUDGET_CAP
+        self._metrics = {"opened": 0, "rejected": 0, "retries": 0, "retries_denied": 0}
+
+    def check(self):
+        """Fail fast while the circuit is open or its half-open trials are all taken;
+        moves to half-open once the cool-down is over"""
+        if self.state == "open":
+            remaining = self._reopen_at - time.monotonic()
+            if remaining > 0:
+                self._metrics["rejected"] += 1
+                raise CircuitOpenError(self.name, retry_after=max(1, math.ceil(remaining)))
+            self.state = "half_open"
+            self._trials = 0
+        if self.state == "half_open" and self._trials >= self.half_open_calls:
+            self._metrics["rejected"] += 1
+            raise CircuitOpenError(self.name, retry_after=1)
+
+    def acquire(self) -> bool:
+        """Admit one call; returns whether it is a half-open trial (pass it back to record/release)"""
+        self.check()
+        if self.state != "half_open":
+            return False
+        self._trials += 1
+        return True
+
+    def release(self, trial: bool):
+        """Forget a call that ended without telling us anything about the backend (e.g. cancelled)"""
+        if trial:
+            self._trials -= 1
+
+    def record(self, success: bool, trial: bool):
+        if trial:
+            self._trials -= 1
+            if success:
+                print(f"Circuit {self.name} closed")
+                self.state = "closed"
+                self._outcomes.clear()
+                self._opened_times = 0
+            else:
+                self._open()
+            return
+        if self.state != "closed":
+            # Started before the circuit opened; trials decide what happens next
+            return
+
+        self._outcomes.append(not success)
+        self._retry_tokens = min(RETRY_BUDGET_CAP, self._retry_tokens + self.retry_ratio)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def _open(self):
+        self._opened_times += 1
+        cooldown = min(self.max_open_seconds, self.open_seconds * 2 ** (self._opened_times - 1))
+        # Jitter so instances sharing a backend don't all probe it at once
+        cooldown *= random.uniform(0.8, 1.2)
+        self.state = "open"
+        self._reopen_at = time.monotonic() + cooldown
+        self._metrics["opened"] += 1
+        print(f"Circuit {self.name} opened for {cooldown:.1f}s")
+
+    def allow_retry(self) -> bool:
+        """Spend one retry from the budget; False if it is empty or the circuit isn't closed"""
+        if self.state == "closed" and self._retry_tokens >= 1:
+            self._retry_tokens -= 1
+            self._metrics["retries"] += 1
+            return True
+        self._metrics["retries_denied"] += 1
+        return False
+
+    def stats(self) -> Dict:
+        failures = sum(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "failure_rate": failures / len(self._outcomes) if self._outcomes else 0.0,
+            "reopens_in_seconds": max(0.0, self._reopen_at - time.monotonic()) if self.state == "open" else 0.0,
+            "retry_budget": round(self._retry_tokens, 2),
+            **self._metrics
+        }
@@ -0,0 +1,165 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+# Rough characters per token, used when the tiktoken encoding can't be loaded
+FALLBACK_CHARS_PER_TOKEN = 4
+
+class ContextBuilder:
+    """Turns retrieved chunks into a compact prompt context under a token budget.
+
+    Candidates are ordered by maximal marginal relevance so near-duplicate
+    chunks don't crowd out other material, then packed in that order while the
+    prompt fits. Packed chunks that are neighbours in the same material are
+    merged, dropping the text the chunker repeated between them. Conversation
+    history shares the same budget.
+    """
+
+    def __init__(self, token_budget: int, history_share: float, mmr_lambda: float, encoding_name: str, chunk_overlap: int):
+        self.token_budget = token_budget
+        self.history_share = history_share
+        self.mmr_lambda = mmr_lambda
+        self.encoding_name = encoding_name
+        self.chunk_overlap = chunk_overlap
+        self._encoding = None
+        self._encoding_failed = False
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        with self._lock:
+            if self._encoding is None and not self._encoding_failed:
+                try:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception as e:
+                    # tiktoken downloads encodings on first use; estimate offline
+                    print(f"Token counting falls back to an estimate: {str(e)}")
+                    self._encoding_failed = True
+            return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return (len(text) + FALLBACK_CHARS_PER_TOKEN - 1) // FALLBACK_CHARS_PER_TOKEN
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text[:max(0, max_tokens) * FALLBACK_CHARS_PER_TOKEN]
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max(0, max_tokens)])
+
+    def mmr_order(self, docs: List[Dict], query_embedding: Optional[List[float]]) -> List[Dict]:
+        """Order docs by maximal marginal relevance to the query; docs without embeddings keep score order"""
+        if not query_embedding or len(docs) < 2 or any(doc.get("embedding") is None for doc in docs):
+            return sorted(docs, key=lambda doc: doc["score"], reverse=True)
+
+        vectors = np.array([doc["embedding"] for doc in docs], dtype="float32")
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype="float32")
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        relevance = vectors @ query
+
+        chosen: List[int] = []
+        remaining = list(range(len(docs)))
+        while remaining:
+            if chosen:
+                redundancy = (vectors[remaining] @ vectors[chosen].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype="float32")
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            chosen.append(remaining.pop(int(np.argmax(scores))))
+        return [docs[i] for i in chosen]
+
+    def _join_overlapping(self, first: str, second: str) -> str:
+        """Concatenate neighbouring chunks, dropping the text repeated at the seam.
+        
+        Only the configured overlap is dropped (a short final chunk lies wholly inside
+        the previous one); chunks indexed with another overlap are joined as they are.
+        """
+        overlap = min(self.chunk_overlap, len(second))
+        if overlap and first.endswith(second[:overlap]):
+            return first + second[overlap:]
+        return first + "\n" + second
+
+    def merge_neighbours(self, docs: List[Dict]) -> List[Dict]:
+        """Merge chunks that are consecutive in the same material into single spans, best span first"""
+        by_material: Dict[int, List[Dict]] = {}
+        for doc in docs:
+            by_material.setdefault(doc["metadata"]["material_id"], []).append(doc)
+
+        spans = []
+        for material_docs in by_material.values():
+            material_docs.sort(key=lambda doc: doc["metadata"]["chunk"])
+            span = None
+            for doc in material_docs:
+                chunk_no = doc["metadata"]["chunk"]
+                if span is not None and chunk_no == span["metadata"]["chunks"][-1] + 1:
+                    span["content"] = self._join_overlapping(span["content"], doc["content"])
+                    span["score"] = max(span["score"], doc["score"])
+                    span["metadata"]["chunks"].append(chunk_no)
+                    continue
+                span = {
+                    "content": doc["content"],
+                    "score": doc["score"],
+                    "metadata": {**doc["metadata"], "chunks": [chunk_no]}
+                }
+                spans.append(span)
+        return sorted(spans, key=lambda span: span["score"], reverse=True)
+
+    @staticmethod
+    def render(spans: List[Dict]) -> str:
+        return "\n\n".join(span["content"] for span in spans)
+
+    def fit_history(self, history: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+        """Keep the most recent whole messages that fit in max_tokens"""
+        kept = []
+        used = 0
+        for message in reversed(history or []):
+            tokens = self.count_tokens(message.get("content", ""))
+            if used + tokens > max_tokens:
+                break
+            kept.insert(0, message)
+            used += tokens
+        return kept, used
+
+    def build(
+        self,
+        docs: List[Dict],
+        query_embedding: Optional[List[float]],
+        prompt_tokens: int,
+        history: List[Dict] = None,
+        token_budget: int = None
+    ) -> Tuple[str, List[Dict], List[Dict]]:
+        """Pack docs (and history) into what's left of the budget after prompt_tokens.
+
+        Returns (context, kept_history, spans), spans being the merged docs in the context.
+        """
+        available = max(0, (token_budget or self.token_budget) - prompt_tokens)
+        kept_history, history_tokens = self.fit_history(history, int(available * self.history_share))
+        context_budget = available - history_tokens
+
+        selected: List[Dict] = []
+        for doc in self.mmr_order(docs, query_embedding):
+            candidate = selected + [doc]
+            if self.count_tokens(self.render(self.merge_neighbours(candidate))) <= context_budget:
+                selected = candidate
+
+        spans = self.merge_neighbours(selected)
+        if not spans and docs:
+            # Always ground the answer in something: trim the best chunk to the budget
+            best = max(docs, key=lambda doc: doc["score"])
+            spans = self.merge_neighbours([{**best, "content": self.truncate(best["content"], context_budget)}])
+
+        return self.render(spans), kept_history, spans
+
+context_builder = ContextBuilder(
+    token_budget=settings.RAG_CONTEXT_TOKEN_BUDGET,
+    history_share=settings.RAG_HISTORY_MAX_SHARE,
+    mmr_lambda=settings.RAG_MMR_LAMBDA,
+    encoding_name=settings.CONTEXT_TOKEN_ENCODING,
+    chunk_overlap=settings.CHUNK_OVERLAP
+)
@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.chunk_store import ChunkStore, ChunkStoreWriter
+
+# Layout version of {store}_metadata.json
+STORE_FORMAT = 2
+
+class CourseStore:
+    """A loaded course vector store: FAISS index, metadata and chunk segments.
+
+    Every material occupies a contiguous range of vector IDs
+    [first_id, first_id + num_chunks) and a run of rows in one segment.
+    Removed materials become tombstones: their vectors stay in the index
+    until compaction but are excluded from every search.
+    """
+
+    def __init__(self, index, metadata: Dict, directory: Path, index_bytes: int = 0):
+        self.index = index
+        self.metadata = metadata
+        self.directory = directory
+        self.index_bytes = index_bytes
+        # Map every segment now: a mapping outlives the file, which compaction may delete
+        self.segments = {
+            segment_id: ChunkStore(directory / segment["chunk_file"])
+            for segment_id, segment in metadata["segments"].items()
+        }
+        self._vectors: Dict[int, np.ndarray] = {
+            segment_id: np.load(directory / segment["vector_file"], mmap_mode="r")
+            for segment_id, segment in metadata["segments"].items()
+        }
+
+        live = sorted(metadata["materials"].items(), key=lambda m: m[1]["first_id"])
+        self._starts = np.array([material["first_id"] for _, material in live], dtype="int64")
+        self._material_ids = [material_id for material_id, _ in live]
+
+        dead = [self.id_range(tombstone) for tombstone in metadata["tombstones"]]
+        self.dead_ids = np.concatenate(dead) if dead else np.zeros(0, dtype="int64")
+
+    @staticmethod
+    def id_range(material: Dict) -> np.ndarray:
+        return np.arange(material["first_id"], material["first_id"] + material["num_chunks"], dtype="int64")
+
+    @property
+    def live_count(self) -> int:
+        return sum(material["num_chunks"] for material in self.metadata["materials"].values())
+
+    def live_ids(self, material_ids: List[int]) -> np.ndarray:
+        """Vector IDs of the given materials that are live in this store"""
+        ranges = [
+            self.id_range(self.metadata["materials"][material_id])
+            for material_id in material_ids
+            if material_id in self.metadata["materials"]
+        ]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype="int64")
+
+    def resolve(self, vector_id: int) -> Optional[Tuple[int, Dict, int]]:
+        """Map a vector ID to (material_id, material, chunk_no), or None if it isn't live"""
+        position = int(np.searchsorted(self._starts, vector_id, side="right")) - 1
+        if position < 0:
+            return None
+        material_id = self._material_ids[position]
+        material = self.metadata["materials"][material_id]
+        chunk_no = vector_id - material["first_id"]
+        if chunk_no >= material["num_chunks"]:
+            return None
+        return material_id, material, chunk_no
+
+    def chunk(self, material: Dict, chunk_no: int) -> str:
+        return self.segments[material["segment"]].get(material["row"] + chunk_no)
+
+    def vector(self, material: Dict, chunk_no: int) -> np.ndarray:
+        """Raw (uncompressed, full-dimension) embedding of a chunk, read from its segment"""
+        vectors = self._vectors[material["segment"]]
+        return np.array(vectors[material["row"] + chunk_no], dtype="float32")
+
+    def resident_size(self) -> int:
+        return self.dead_ids.nbytes + sum(segment.resident_size() for segment in self.segments.values())
+
+class SegmentWriter:
+    """A new segment, written slice by slice as its chunks are embedded.
+
+    Chunk text and vectors go to pending files in the store directory, so
+    a material is never held in memory whole. Once finished, the owner of
+    the store lock renames them into place (RAGService._write_segment);
+    discard() removes whatever was not taken.
+    """
+
+    def __init__(self, directory: Path, compress: bool = False, rows_per_block: int = 64):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex
+        self.chunk_path = self.directory / f".pending_{token}.chunks"
+        self.vector_path = self.directory / f".pending_{token}.vectors.npy"
+        self.num_rows = 0
+        self.dimension = 0
+        self._chunks = ChunkStoreWriter(self.chunk_path, compress=compress, rows_per_block=rows_per_block)
+        self._vectors = tempfile.TemporaryFile(dir=self.directory)
+        self._finished = False
+
+    def append(self, chunks: List[str], vectors: np.ndarray):
+        """Add a slice of chunks and their (n, dimension) float32 vectors"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if vectors.ndim != 2 or len(vectors) != len(chunks):
+            raise ValueError(f"Expected {len(chunks)} vectors, got shape {vectors.shape}")
+        if self.num_rows and vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension changed from {self.dimension} to {vectors.shape[1]}")
+        self.dimension = vectors.shape[1]
+        for chunk in chunks:
+            self._chunks.add(chunk)
+        self._vectors.write(vectors.tobytes())
+        self.num_rows += len(chunks)
+
+    def finish(self):
+        """Write the pending chunk store and .npy file"""
+        self._chunks.close()
+        try:
+            with open(self.vector_path, "wb") as f:
+                np.lib.format.write_array_header_1_0(f, {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype("float32")),
+                    "fortran_order": False,
+                    "shape": (self.num_rows, self.dimension)
+                })
+                self._vectors.seek(0)
+                shutil.copyfileobj(self._vectors, f)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            self._vectors.close()
+        self._finished = True
+
+    def vectors(self) -> np.ndarray:
+        """The finished vectors, memory-mapped from the pending file"""
+        return np.load(self.vector_path, mmap_mode="r")
+
+    def discard(self):
+        """Drop the pending files; a no-op once they were renamed into place"""
+        if not self._finished:
+            self._chunks.abort()
+            self._vectors.close()
+        for path in (self.chunk_path, self.vector_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
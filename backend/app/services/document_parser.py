@@ -0,0 +1,22 @@
+"""Document text extraction, run in the parsing process pool.
+
+Functions here are module-level and import nothing from the app beyond the
+parsers themselves, so spawned worker processes start quickly.
+"""
+from typing import List
+
+from pypdf import PdfReader
+from docx import Document
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop), one newline-terminated string per page"""
+    reader = PdfReader(file_path)
+    return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, min(stop, len(reader.pages)))]
+
+def extract_docx_paragraphs(file_path: str) -> List[str]:
+    doc = Document(file_path)
+    return [paragraph.text + "\n" for paragraph in doc.paragraphs]
+
+def warm_up() -> bool:
+    """No-op task that makes the pool start its processes (and import the parsers) ahead of time"""
+    return True
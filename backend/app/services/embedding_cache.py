@@ -0,0 +1,77 @@
+import hashlib
+import time
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.sqlite_lru_cache import SQLiteLRUCache
+
+class EmbeddingCache(SQLiteLRUCache):
+    """Disk-backed embedding cache keyed by (embedding model, SHA-256 of text).
+
+    Entries are evicted least-recently-used first once the stored vectors
+    exceed max_bytes.
+    """
+
+    table = "embeddings"
+    key_columns = ("model", "text_hash")
+    schema = """CREATE TABLE IF NOT EXISTS embeddings (
+        model TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (model, text_hash)
+    )"""
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Return {text_hash: float32 embedding} for the texts that are cached"""
+        hashes = list({self.hash_text(text) for text in texts})
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+            hit_count = sum(1 for text in texts if self.hash_text(text) in found)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return found
+
+    def put_many(self, model: str, texts: List[str], embeddings: Iterable):
+        """Store embeddings for texts, then evict down to the size budget"""
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            blob = np.asarray(embedding, dtype="float32").tobytes()
+            rows.append((model, self.hash_text(text), blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._evict()
+
+embedding_cache = EmbeddingCache(
+    path=settings.EMBEDDING_CACHE_PATH,
+    max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES
+)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.sqlite_lru_cache import SQLiteLRUCache
+
+class GenerationCache(SQLiteLRUCache):
+    """Disk-backed cache of Ollama generations keyed by a hash of the request.
+
+    Only deterministic (or explicitly cacheable) generations belong here: the
+    key covers model, system prompt, prompt, format and options, and a hit
+    returns the stored response instead of calling the model. Least-recently-used
+    entries are evicted once the stored responses exceed max_bytes. Switching
+    to another chat model empties the cache.
+    """
+
+    table = "generations"
+    key_columns = ("key_hash",)
+    schema = """CREATE TABLE IF NOT EXISTS generations (
+        key_hash TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL
+    )"""
+
+    def __init__(self, path: str, max_bytes: int, model: str):
+        super().__init__(path, max_bytes)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._reset_on_model_change(model)
+        self._conn.commit()
+
+    def _reset_on_model_change(self, model: str):
+        row = self._conn.execute("SELECT value FROM cache_info WHERE key = 'model'").fetchone()
+        if row is not None and row[0] != model:
+            print(f"Chat model changed from {row[0]} to {model}; clearing the generation cache")
+            self._conn.execute("DELETE FROM generations")
+        self._conn.execute("INSERT OR REPLACE INTO cache_info (key, value) VALUES ('model', ?)", (model,))
+
+    @staticmethod
+    def make_key(model: str, system: Optional[str], prompt: str, format: Optional[str], options: Dict) -> str:
+        request = {"model": model, "system": system, "prompt": prompt, "format": format, "options": options}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM generations WHERE key_hash = ?", (key_hash,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE generations SET last_used = ? WHERE key_hash = ?", (time.time(), key_hash))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key_hash: str, response: str):
+        """Store a response, then evict down to the size budget"""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key_hash, response, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key_hash, response, size, now, now)
+            )
+            self._conn.commit()
+            self._evict()
+
+generation_cache = GenerationCache(
+    path=settings.GENERATION_CACHE_PATH,
+    max_bytes=settings.GENERATION_CACHE_MAX_BYTES,
+    model=settings.OLLAMA_MODEL
+)
@@ -0,0 +1,282 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import and_, or_
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.course import CourseMaterial
+from app.models.ingestion import IngestionJob
+from app.services.rag_service import rag_service
+from app.services.blocking_executor import blocking_executor
+from app.services.admission_scheduler import OverloadedError
+
+class IngestionService:
+    """Background pipeline that indexes uploaded materials: extract -> chunk -> embed -> index.
+
+    Extraction, chunking and embedding run as one streaming stage (see
+    RAGService.embed_file), so embedding starts while later pages are parsed.
+
+    Jobs are persisted in ingestion_jobs so progress can be polled and
+    unfinished jobs are picked up again after a restart. Several processes
+    may share the table: a job is claimed with a conditional UPDATE and held
+    under a lease that its owner renews while it runs, so a job is only
+    taken over once its owner has stopped.
+    """
+
+    def __init__(self):
+        self.num_workers = settings.INGESTION_WORKERS
+        self.max_attempts = settings.INGESTION_MAX_ATTEMPTS
+        self.lease = timedelta(seconds=settings.INGESTION_LEASE_SECONDS)
+        self.progress_interval = settings.INGESTION_PROGRESS_INTERVAL
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[int] = set()
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self):
+        """Start workers, queue unfinished jobs and keep watching for abandoned ones"""
+        self._queue = asyncio.Queue()
+        self._queued = set()
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+
+        job_ids = await blocking_executor.run(self._claimable_jobs, timedelta(0))
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        if job_ids:
+            print(f"Resuming {len(job_ids)} unfinished ingestion jobs")
+        self._workers.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, db, course_id: int, material_id: int) -> IngestionJob:
+        """Persist a job for a material and queue it for the workers"""
+        job = IngestionJob(course_id=course_id, material_id=material_id, status="pending")
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        if self._queue is not None:
+            self._enqueue(job.id)
+        return job
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _enqueue(self, job_id: int):
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                print(f"Ingestion worker {worker_id} crashed on job {job_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _reaper(self):
+        """Queue jobs another process abandoned (expired lease) or never got to"""
+        while True:
+            await asyncio.sleep(self.lease.total_seconds())
+            try:
+                job_ids = await blocking_executor.run(self._claimable_jobs, self.lease)
+            except Exception as e:
+                print(f"Failed to look for abandoned ingestion jobs: {str(e)}")
+                continue
+            for job_id in job_ids:
+                self._enqueue(job_id)
+
+    def _claimable(self, now: datetime):
+        expired = or_(IngestionJob.lease_expires_at.is_(None), IngestionJob.lease_expires_at < now)
+        return or_(IngestionJob.status == "pending", and_(IngestionJob.status == "running", expired))
+
+    def _claimable_jobs(self, pending_for: timedelta) -> List[int]:
+        """IDs of running jobs whose lease expired and of pending jobs idle for pending_for"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            rows = db.query(IngestionJob.id).filter(
+                self._claimable(now),
+                or_(IngestionJob.status == "running", IngestionJob.updated_at <= now - pending_for)
+            ).order_by(IngestionJob.id).all()
+            return [row.id for row in rows]
+        finally:
+            db.close()
+
+    def _claim(self, job_id: int) -> Optional[Dict]:
+        """Atomically take a job for this process; returns what it needs, or None if it isn't claimable"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            claimed = db.query(IngestionJob).filter(
+                IngestionJob.id == job_id,
+                self._claimable(now)
+            ).update({
+                "status": "running",
+                "owner": self.owner,
+                "lease_expires_at": now + self.lease,
+                "attempts": IngestionJob.attempts + 1,
+                "started_at": now,
+                "error": None
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+
+            job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+            material = db.query(CourseMaterial).filter(CourseMaterial.id == job.material_id).first()
+            if not material:
+                job.status = "failed"
+                job.error = "Material no longer exists"
+                job.owner = None
+                job.lease_expires_at = None
+                db.commit()
+                return None
+            return {
+                "course_id": material.course_id,
+                "material_id": material.id,
+                "material_title": material.title,
+                "file_path": material.file_path,
+                "attempts": job.attempts
+            }
+        finally:
+            db.close()
+
+    def _update_job(self, job_id: int, **fields) -> bool:
+        """Update a job this process owns; returns False if it has lost the job"""
+        db = SessionLocal()
+        try:
+            updated = db.query(IngestionJob).filter(
+                IngestionJob.id == job_id,
+                IngestionJob.owner == self.owner
+            ).update(fields, synchronize_session=False)
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    def _release_job(self, job_id: int, status: str, **fields) -> bool:
+        return self._update_job(job_id, status=status, owner=None, lease_expires_at=None, **fields)
+
+    async def _heartbeat(self, job_id: int, progress: Dict, stopped: asyncio.Event):
+        """Write the latest progress and renew the lease every progress_interval seconds until stopped"""
+        while not stopped.is_set():
+            try:
+                await blocking_executor.run(
+                    self._update_job, job_id, lease_expires_at=datetime.utcnow() + self.lease, **progress
+                )
+            except Exception as e:
+                print(f"Failed to update ingestion job {job_id}: {str(e)}")
+            try:
+                await asyncio.wait_for(stopped.wait(), self.progress_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _complete_job(self, job_id: int, material_id: int, vector_store_id: str, num_chunks: int) -> bool:
+        """Point the material at its store and mark the job done; False if the material was deleted"""
+        db = SessionLocal()
+        try:
+            updated = db.query(CourseMaterial).filter(CourseMaterial.id == material_id).update(
+                {"vector_store_id": vector_store_id}
+            )
+            if not updated:
+                db.rollback()
+                return False
+            db.query(IngestionJob).filter(
+                IngestionJob.id == job_id,
+                IngestionJob.owner == self.owner
+            ).update({
+                "status": "completed",
+                "stage": None,
+                "progress": 100,
+                "total_chunks": num_chunks,
+                "embedded_chunks": num_chunks,
+                "owner": None,
+                "lease_expires_at": None,
+                "completed_at": datetime.utcnow()
+            })
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    async def _index_material(self, job: Dict, progress: Dict) -> str:
+        # Parsing, chunking and embedding overlap; report as each slice is embedded
+        async def on_progress(embedded: int, parsed: int, parsing_done: bool):
+            value = 10 + int(80 * embedded / parsed) if parsed else 10
+            progress.update(
+                stage="embed",
+                total_chunks=parsed,
+                embedded_chunks=embedded,
+                progress=max(progress["progress"], value if parsing_done else min(value, 50))
+            )
+
+        segment = await rag_service.embed_file(job["file_path"], on_progress=on_progress)
+        try:
+            if not segment.num_rows:
+                raise ValueError("Could not extract text from file")
+
+            progress.update(stage="index", progress=90)
+            return await blocking_executor.run(
+                rag_service.add_material_to_store,
+                job["course_id"], job["material_id"], job["material_title"], segment
+            )
+        finally:
+            segment.discard()
+
+    async def _run_job(self, job_id: int):
+        job = await blocking_executor.run(self._claim, job_id)
+        if job is None:
+            return
+        attempts = job["attempts"]
+
+        # Progress is written by the heartbeat, at most every progress_interval seconds
+        progress = {"stage": "extract", "progress": 5}
+        stopped = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, progress, stopped))
+        try:
+            vector_store_id = await self._index_material(job, progress)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            # Let a write in flight finish, so it can't land after the job is released
+            stopped.set()
+            await heartbeat
+
+        if isinstance(error, OverloadedError):
+            # Ollama is busy or unavailable: retry later without using up an attempt
+            print(f"Ingestion job {job_id} deferred for {error.retry_after}s: {error.detail}")
+            await blocking_executor.run(
+                self._release_job, job_id, "pending", attempts=attempts - 1, error=error.detail
+            )
+            asyncio.get_running_loop().call_later(error.retry_after, self._enqueue, job_id)
+        elif error is not None:
+            print(f"Ingestion job {job_id} failed (attempt {attempts}): {str(error)}")
+            if attempts < self.max_attempts:
+                await blocking_executor.run(self._release_job, job_id, "pending", error=str(error))
+                self._enqueue(job_id)
+            else:
+                await blocking_executor.run(
+                    self._release_job, job_id, "failed", error=str(error), completed_at=datetime.utcnow()
+                )
+        elif not await blocking_executor.run(
+            self._complete_job, job_id, job["material_id"], vector_store_id, progress.get("embedded_chunks", 0)
+        ):
+            # The material was deleted while it was being indexed
+            await blocking_executor.run(rag_service.remove_material_from_store, job["course_id"], job["material_id"])
+
+ingestion_service = IngestionService()
@@ -0,0 +1,164 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+# Ollama reports durations in nanoseconds
+NANOSECONDS = 1e9
+# A load_duration above this means Ollama had to load the model for the call
+MODEL_LOAD_SECONDS = 0.5
+
+HISTOGRAM_BUCKETS = {
+    "prompt_tokens": [64, 128, 256, 512, 1024, 2048, 4096, 8192],
+    "completion_tokens": [16, 32, 64, 128, 256, 512, 1024, 2048],
+    "tokens_per_second": [1, 2, 5, 10, 20, 50, 100, 200],
+    "load_seconds": [0.01, 0.1, 0.5, 1, 2, 5, 10, 30],
+    "prompt_eval_seconds": [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    "eval_seconds": [0.5, 1, 2.5, 5, 10, 20, 40, 80],
+    "total_seconds": [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+}
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None if empty or above the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": buckets
+        }
+
+class LLMMetrics:
+    """Token counts and timings from Ollama responses, per operation and caller.
+
+    Ollama returns prompt_eval_count, eval_count and load / prompt_eval / eval
+    durations with every completed call. Each (operation, caller) pair keeps
+    counters and histograms of these, and a per-minute timeline of the last
+    window_minutes shows tokens per second and prompt size over time. That is
+    enough to tell prompt bloat, model loads and slow generation apart.
+    """
+
+    def __init__(self, window_minutes: int):
+        self.window_minutes = window_minutes
+        self._series: Dict[Tuple[str, str], Dict] = {}
+        self._timeline: deque = deque(maxlen=window_minutes)
+
+    def _get_series(self, operation: str, caller: str) -> Dict:
+        key = (operation, caller)
+        if key not in self._series:
+            self._series[key] = {
+                "calls": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "model_loads": 0,
+                "histograms": {name: Histogram(buckets) for name, buckets in HISTOGRAM_BUCKETS.items()}
+            }
+        return self._series[key]
+
+    def _current_minute(self) -> Dict:
+        minute = int(time.time() // 60) * 60
+        if not self._timeline or self._timeline[-1]["minute"] != minute:
+            self._timeline.append({
+                "minute": minute,
+                "calls": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "eval_seconds": 0.0,
+                "load_seconds": 0.0,
+                "model_loads": 0
+            })
+        return self._timeline[-1]
+
+    def record(self, operation: str, caller: str, data: Dict, wall_seconds: float):
+        """Record one completed call from the final Ollama response body (stream: the "done" line)"""
+        series = self._get_series(operation, caller)
+        minute = self._current_minute()
+        histograms = series["histograms"]
+        prompt_tokens = data.get("prompt_eval_count") or 0
+        completion_tokens = data.get("eval_count") or 0
+        load_seconds = (data.get("load_duration") or 0) / NANOSECONDS
+        eval_seconds = (data.get("eval_duration") or 0) / NANOSECONDS
+        loaded = load_seconds > MODEL_LOAD_SECONDS
+
+        for counters in (series, minute):
+            counters["calls"] += 1
+            counters["prompt_tokens"] += prompt_tokens
+            counters["completion_tokens"] += completion_tokens
+            counters["model_loads"] += int(loaded)
+        minute["eval_seconds"] += eval_seconds
+        minute["load_seconds"] += load_seconds
+
+        # Older Ollama endpoints (/api/embeddings) report no counts at all
+        if "prompt_eval_count" in data:
+            histograms["prompt_tokens"].observe(prompt_tokens)
+        if "load_duration" in data:
+            histograms["load_seconds"].observe(load_seconds)
+        if "prompt_eval_duration" in data:
+            histograms["prompt_eval_seconds"].observe(data["prompt_eval_duration"] / NANOSECONDS)
+        if "eval_count" in data:
+            histograms["completion_tokens"].observe(completion_tokens)
+        if eval_seconds > 0:
+            histograms["eval_seconds"].observe(eval_seconds)
+            histograms["tokens_per_second"].observe(completion_tokens / eval_seconds)
+        histograms["total_seconds"].observe(wall_seconds)
+
+    def record_error(self, operation: str, caller: str):
+        self._get_series(operation, caller)["errors"] += 1
+        self._current_minute()["errors"] += 1
+
+    def summary(self, minutes: Optional[int] = None) -> Dict:
+        since = time.time() - 60 * (minutes or self.window_minutes)
+        timeline = []
+        for minute in self._timeline:
+            if minute["minute"] < since - 60:
+                continue
+            timeline.append({
+                **minute,
+                "tokens_per_second": round(minute["completion_tokens"] / minute["eval_seconds"], 2) if minute["eval_seconds"] else None,
+                "avg_prompt_tokens": round(minute["prompt_tokens"] / minute["calls"], 1) if minute["calls"] else None
+            })
+
+        series = []
+        for (operation, caller), data in sorted(self._series.items()):
+            series.append({
+                "operation": operation,
+                "caller": caller,
+                **{name: data[name] for name in ("calls", "errors", "prompt_tokens", "completion_tokens", "model_loads")},
+                "histograms": {name: histogram.to_dict() for name, histogram in data["histograms"].items()}
+            })
+        return {"window_minutes": minutes or self.window_minutes, "series": series, "timeline": timeline}
+
+llm_metrics = LLMMetrics(window_minutes=settings.LLM_METRICS_WINDOW_MINUTES)
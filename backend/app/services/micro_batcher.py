@@ -0,0 +1,79 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+class MicroBatcher:
+    """Coalesces concurrent calls that share a key into one batched call.
+
+    Items submitted under the same key within window_ms of the first one (or
+    until max_batch_size items have arrived) are passed together to
+    handler(key, items), which returns one result per item. Each caller gets
+    back only the result at its own position; if the handler raises, every
+    caller in the batch sees the exception, as it does if the handler returns
+    the wrong number of results or the batch is cancelled.
+    """
+
+    def __init__(self, handler: Callable[[Hashable, List[Any]], Awaitable[List[Any]]], window_ms: float, max_batch_size: int):
+        self.handler = handler
+        self.window_seconds = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_batch_size or self.window_seconds <= 0:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+        return await future
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        # Run detached so a caller being cancelled doesn't cancel the whole batch
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]):
+        try:
+            results = await self.handler(key, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # A cancelled batch (e.g. at shutdown) must not leave its callers waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Batch was cancelled before it completed"))
+
+    def stats(self) -> Dict:
+        return {
+            "window_ms": self.window_seconds * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "items": self.items,
+            "largest_batch": self.largest_batch,
+            "average_batch_size": self.items / self.batches if self.batches else 0.0
+        }
@@ -1,24 +1,287 @@
+import asyncio
+import json
+import random
+import time
 import httpx
-from typing import List, Dict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Dict, AsyncIterator, Optional, Tuple, TypeVar
 from app.core.config import settings
+from app.services.admission_scheduler import AdmissionScheduler, OverloadedError
+from app.services.single_flight import SingleFlight
+from app.services.generation_cache import generation_cache
+from app.services.blocking_executor import blocking_executor
+from app.services.backend_pool import Backend, BackendPool
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_metrics import llm_metrics
+
+T = TypeVar("T")
+
+GENERATE_NUM_PREDICT = 2000  # Allow longer responses
+UNAVAILABLE_DETAIL = "The AI service is temporarily unavailable, please retry shortly"
+
+class OllamaUnavailableError(OverloadedError):
+    """Raised when Ollama fails a call a user is waiting on; the app maps it to 503"""
+
+    def __init__(self, detail: str, retry_after: int = 1):
+        super().__init__(503, detail, retry_after)
+
+class StreamInterruptedError(Exception):
+    """Raised when a chat stream ends before Ollama reports it done; the tokens so far are incomplete"""
 
 class OllamaService:
     def __init__(self):
-        self.base_url = settings.OLLAMA_BASE_URL
+        self.chat_pool = BackendPool(
+            "chat",
+            settings.OLLAMA_CHAT_BACKENDS or [settings.OLLAMA_BASE_URL],
+            failure_threshold=settings.OLLAMA_BACKEND_FAILURE_THRESHOLD
+        )
+        self.embed_pool = BackendPool(
+            "embed",
+            settings.OLLAMA_EMBED_BACKENDS or [settings.OLLAMA_BASE_URL],
+            failure_threshold=settings.OLLAMA_BACKEND_FAILURE_THRESHOLD
+        )
+        self.breakers = {
+            name: CircuitBreaker(
+                name,
+                failure_rate=settings.OLLAMA_CIRCUIT_FAILURE_RATE,
+                window_size=settings.OLLAMA_CIRCUIT_WINDOW,
+                min_calls=settings.OLLAMA_CIRCUIT_MIN_CALLS,
+                open_seconds=settings.OLLAMA_CIRCUIT_OPEN_SECONDS,
+                max_open_seconds=settings.OLLAMA_CIRCUIT_MAX_OPEN_SECONDS,
+                half_open_calls=settings.OLLAMA_CIRCUIT_HALF_OPEN_CALLS,
+                retry_ratio=settings.OLLAMA_RETRY_BUDGET_RATIO
+            )
+            for name in ("chat", "embed")
+        }
+        self.health_check_interval = settings.OLLAMA_HEALTH_CHECK_INTERVAL
+        self._health_task: Optional[asyncio.Task] = None
         self.model = settings.OLLAMA_MODEL
         self.embedding_model = settings.OLLAMA_EMBEDDING_MODEL
+        self.embed_batch_size = settings.OLLAMA_EMBED_BATCH_SIZE
+        self.embed_concurrency = settings.OLLAMA_EMBED_CONCURRENCY
+        self.embed_max_retries = settings.OLLAMA_EMBED_MAX_RETRIES
+        self.keep_alive = settings.OLLAMA_KEEP_ALIVE
+        self.limits = httpx.Limits(
+            max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY
+        )
+        self.generate_timeout = self._timeout(settings.OLLAMA_GENERATE_TIMEOUT)
+        self.embed_timeout = self._timeout(settings.OLLAMA_EMBED_TIMEOUT)
+        self.load_timeout = self._timeout(settings.OLLAMA_LOAD_TIMEOUT)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        # Chat, quiz generation and ingestion compete for the same Ollama host
+        self.scheduler = AdmissionScheduler(
+            settings.OLLAMA_PRIORITY_CLASSES,
+            max_concurrency=settings.OLLAMA_MAX_CONCURRENT_REQUESTS
+        )
+        self.single_flight_enabled = settings.OLLAMA_SINGLE_FLIGHT
+        self.single_flight_max_temperature = settings.OLLAMA_SINGLE_FLIGHT_MAX_TEMPERATURE
+        self.single_flight = SingleFlight()
+        self.generation_cache_enabled = settings.GENERATION_CACHE_ENABLED
+
+    @staticmethod
+    def _timeout(seconds: float) -> httpx.Timeout:
+        # Fail fast when Ollama is unreachable, however long the operation may run
+        return httpx.Timeout(seconds, connect=settings.OLLAMA_CONNECT_TIMEOUT)
+
+    async def start(self):
+        """Open the shared connection pool and start health probes (called from the app lifespan)"""
+        if self._client is None:
+            self._client = self._new_client()
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._probe_backends())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.generate_timeout,
+            event_hooks={"request": [self._count_request]}
+        )
+
+    async def _count_request(self, request: httpx.Request):
+        self.requests += 1
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared pooled client; created on first use outside the app (scripts)"""
+        if self._client is None:
+            self._client = self._new_client()
+        return self._client
+
+    def pool_stats(self) -> Dict:
+        """Connection pool usage of the shared client"""
+        stats = {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "requests": self.requests,
+            "open_connections": 0,
+            "idle_connections": 0
+        }
+        if self._client is not None:
+            # httpx has no public pool API; read httpcore's connection list
+            connections = getattr(getattr(self._client._transport, "_pool", None), "connections", [])
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+        return stats
 
-    async def generate(self, prompt: str, system: str = None, temperature: float = 0.7, format: str = None) -> str:
-        """Generate text using Ollama"""
+    async def _probe_backends(self):
+        """Periodically check every backend so failed ones rejoin (and dead idle ones leave) rotation"""
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            checks = [(pool, backend) for pool in (self.chat_pool, self.embed_pool) for backend in pool.backends]
+            await asyncio.gather(*(self._probe(pool, backend) for pool, backend in checks))
+
+    async def _probe(self, pool: BackendPool, backend: Backend):
+        try:
+            response = await self.client.get(
+                f"{backend.url}/api/version",
+                timeout=self._timeout(settings.OLLAMA_CONNECT_TIMEOUT)
+            )
+            pool.record_response(backend, response)
+        except httpx.HTTPError as e:
+            pool.record_failure(backend, f"health probe: {type(e).__name__}")
+
+    async def _post(self, pool: BackendPool, path: str, **kwargs) -> httpx.Response:
+        """POST to the least loaded backend of pool, trying another one if it can't be reached.
+        
+        Raises CircuitOpenError without sending anything while the pool's circuit is open.
+        """
+        breaker = self.breakers[pool.name]
+        trial = breaker.acquire()
+        tried = set()
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
+            while True:
+                backend = pool.pick(exclude=tried)
+                tried.add(backend.url)
+                try:
+                    async with pool.track(backend):
+                        response = await self.client.post(f"{backend.url}{path}", **kwargs)
+                except httpx.ConnectError:
+                    # The request never reached the backend, so it is safe to send elsewhere
+                    if len(tried) < len(pool.backends) and breaker.allow_retry():
+                        continue
+                    raise
+                pool.record_response(backend, response)
+                breaker.record(response.status_code < 500, trial)
+                return response
+        except httpx.TransportError:
+            breaker.record(False, trial)
+            raise
+        except BaseException:
+            breaker.release(trial)
+            raise
+
+    def check_available(self, pool_name: str):
+        """Raise CircuitOpenError if calls to the pool ("chat" or "embed") would fail fast right now"""
+        self.breakers[pool_name].check()
+
+    def backend_stats(self) -> Dict:
+        return {
+            name: {**pool.stats(), "circuit": self.breakers[name].stats()}
+            for name, pool in (("chat", self.chat_pool), ("embed", self.embed_pool))
+        }
+
+    @asynccontextmanager
+    async def admission(self, priority: Optional[str]):
+        """Hold a scheduler slot of the given priority class; None if the caller already holds one"""
+        if priority is None:
+            yield
+            return
+        async with self.scheduler.slot(priority):
+            yield
+
+    async def coalesce(self, operation: str, key: Tuple, fn: Callable[[], Awaitable[T]], share: bool) -> T:
+        """Run fn, sharing one upstream call with identical requests in flight when share is set"""
+        if not (share and self.single_flight_enabled):
+            return await fn()
+        return await self.single_flight.run((operation,) + key, fn, operation=operation)
+
+    def _is_deterministic(self, temperature: float, coalesce: Optional[bool]) -> bool:
+        # Sampled output differs per request, so only share it when the caller says any answer will do
+        return coalesce if coalesce is not None else temperature <= self.single_flight_max_temperature
+
+    async def generate(
+        self,
+        prompt: str,
+        system: str = None,
+        temperature: float = 0.7,
+        format: str = None,
+        priority: Optional[str] = "generation",
+        coalesce: Optional[bool] = None,
+        cache: Optional[bool] = None,
+        caller: str = "other"
+    ) -> str:
+        """Generate text using Ollama.
+        
+        Identical concurrent requests share one upstream call when the temperature
+        is deterministic, or when coalesce=True; coalesce=False never shares.
+        Temperature-0 generations are also kept in the persistent generation
+        cache; cache=True caches a sampled one too, cache=False never caches.
+        caller labels the call's token and timing metrics (see llm_metrics).
+        Raises OllamaUnavailableError (503) if the call fails.
+        """
+        use_cache = self.generation_cache_enabled and (cache if cache is not None else temperature == 0)
+        run = self._generate_cached if use_cache else self._generate
+        return await self.coalesce(
+            "generate",
+            (self.model, priority, prompt, system, temperature, format),
+            lambda: run(prompt, system, temperature, format, priority, caller),
+            use_cache or self._is_deterministic(temperature, coalesce)
+        )
+
+    async def _generate_cached(
+        self,
+        prompt: str,
+        system: Optional[str],
+        temperature: float,
+        format: Optional[str],
+        priority: Optional[str],
+        caller: str
+    ) -> str:
+        options = {"temperature": temperature, "num_predict": GENERATE_NUM_PREDICT}
+        key_hash = generation_cache.make_key(self.model, system, prompt, format, options)
+        cached = await blocking_executor.run(generation_cache.get, key_hash)
+        if cached is not None:
+            return cached
+        
+        response = await self._generate(prompt, system, temperature, format, priority, caller)
+        if response:
+            # An empty answer is never worth replaying
+            await blocking_executor.run(generation_cache.put, key_hash, response)
+        return response
+
+    async def _generate(
+        self,
+        prompt: str,
+        system: Optional[str],
+        temperature: float,
+        format: Optional[str],
+        priority: Optional[str],
+        caller: str
+    ) -> str:
+        self.check_available("chat")
+        async with self.admission(priority):
+            try:
                 payload = {
                     "model": self.model,
+                    "keep_alive": self.keep_alive,
                     "prompt": prompt,
                     "stream": False,
                     "options": {
                         "temperature": temperature,
-                        "num_predict": 2000  # Allow longer responses
+                        "num_predict": GENERATE_NUM_PREDICT
                     }
                 }
                 
@@ -28,53 +291,282 @@ class OllamaService:
                 # Force JSON output if requested (Ollama 0.1.16+)
                 if format == "json":
                     payload["format"] = "json"
-
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload
+                
+                started = time.perf_counter()
+                response = await self._post(
+                    self.chat_pool,
+                    "/api/generate",
+                    json=payload,
+                    timeout=self.generate_timeout
                 )
                 response.raise_for_status()
-                return response.json().get("response", "")
-        except Exception as e:
-            print(f"Ollama generation error: {str(e)}")
-            return ""
+                data = response.json()
+                llm_metrics.record("generate", caller, data, time.perf_counter() - started)
+                return data.get("response", "")
+            except OverloadedError:
+                raise
+            except Exception as e:
+                print(f"Ollama generation error: {str(e)}")
+                llm_metrics.record_error("generate", caller)
+                raise OllamaUnavailableError(UNAVAILABLE_DETAIL) from e
 
-    async def embed(self, text: str) -> List[float]:
-        """Generate embeddings using Ollama"""
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/embeddings",
+    async def embed(self, text: str, priority: Optional[str] = "interactive", caller: str = "other") -> List[float]:
+        """Generate embeddings using Ollama; identical concurrent requests share one upstream call"""
+        embedding = await self.coalesce("embed", (self.embedding_model, priority, text), lambda: self._embed(text, priority, caller), True)
+        # Each caller gets its own list, since the result is shared
+        return list(embedding)
+
+    async def _embed(self, text: str, priority: Optional[str], caller: str) -> List[float]:
+        self.check_available("embed")
+        async with self.admission(priority):
+            try:
+                started = time.perf_counter()
+                response = await self._post(
+                    self.embed_pool,
+                    "/api/embeddings",
                     json={
                         "model": self.embedding_model,
+                        "keep_alive": self.keep_alive,
                         "prompt": text
-                    }
+                    },
+                    timeout=self.embed_timeout
                 )
                 response.raise_for_status()
-                return response.json().get("embedding", [])
-        except Exception as e:
-            print(f"Ollama embedding error: {str(e)}")
+                data = response.json()
+                llm_metrics.record("embed", caller, data, time.perf_counter() - started)
+                return data.get("embedding", [])
+            except OverloadedError:
+                raise
+            except Exception as e:
+                print(f"Ollama embedding error: {str(e)}")
+                llm_metrics.record_error("embed", caller)
+                raise OllamaUnavailableError(UNAVAILABLE_DETAIL) from e
+
+    async def warm_up(self) -> Dict[str, bool]:
+        """Load the chat and embedding models on every backend so they stay resident for keep_alive"""
+        async def load(pool: BackendPool, backend: Backend, path: str, payload: Dict) -> bool:
+            try:
+                started = time.perf_counter()
+                async with pool.track(backend):
+                    response = await self.client.post(f"{backend.url}{path}", json=payload, timeout=self.load_timeout)
+                pool.record_response(backend, response)
+                response.raise_for_status()
+                operation = "generate" if pool is self.chat_pool else "embed"
+                llm_metrics.record(operation, "warmup", response.json(), time.perf_counter() - started)
+                return True
+            except Exception as e:
+                print(f"Ollama warm-up error ({backend.url}): {str(e)}")
+                return False
+        
+        # A generate request without a prompt only loads the model
+        chat_payload = {"model": self.model, "keep_alive": self.keep_alive}
+        embed_payload = {"model": self.embedding_model, "keep_alive": self.keep_alive, "prompt": "warm-up"}
+        chat_loaded, embed_loaded = await asyncio.gather(
+            asyncio.gather(*(load(self.chat_pool, backend, "/api/generate", chat_payload) for backend in self.chat_pool.backends)),
+            asyncio.gather(*(load(self.embed_pool, backend, "/api/embeddings", embed_payload) for backend in self.embed_pool.backends))
+        )
+        return {"chat_model": all(chat_loaded), "embedding_model": all(embed_loaded)}
+
+    async def embed_batch(
+        self,
+        texts: List[str],
+        priority: Optional[str] = "bulk",
+        caller: str = "other",
+        max_retries: Optional[int] = None
+    ) -> List[List[float]]:
+        """Generate embeddings for many texts, batched and with bounded concurrency.
+        
+        Returns one embedding per input, in order. Raises ValueError if a batch
+        still fails after max_retries (default OLLAMA_EMBED_MAX_RETRIES), so
+        callers never get misaligned results. Each batch request is admitted
+        separately under the given priority class. Raises CircuitOpenError at
+        once while the embedding circuit is open.
+        """
+        if not texts:
             return []
+        self.check_available("embed")
+        
+        batches = [
+            texts[i:i + self.embed_batch_size]
+            for i in range(0, len(texts), self.embed_batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.embed_concurrency)
+        if max_retries is None:
+            max_retries = self.embed_max_retries
 
-    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> str:
-        """Chat with Ollama"""
-        try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/chat",
+        async def run(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_batch_with_retry(batch, priority, caller, max_retries)
+        
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        
+        return [embedding for batch_result in results for embedding in batch_result]
+
+    async def _embed_batch_with_retry(self, batch: List[str], priority: Optional[str], caller: str, max_retries: int) -> List[List[float]]:
+        last_error = None
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                if not self.breakers["embed"].allow_retry():
+                    break
+                # Jittered exponential backoff so failed batches don't retry in lockstep
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                async with self.admission(priority):
+                    embeddings = await self._post_embed_batch(batch, caller)
+                if len(embeddings) == len(batch) and all(embeddings):
+                    return embeddings
+                last_error = f"expected {len(batch)} embeddings, got {len(embeddings)}"
+            except OverloadedError:
+                raise
+            except Exception as e:
+                last_error = str(e)
+            llm_metrics.record_error("embed", caller)
+            print(f"Ollama batch embedding attempt {attempt + 1} failed: {last_error}")
+        raise ValueError(f"Could not embed batch of {len(batch)} texts: {last_error}")
+
+    async def _post_embed_batch(self, batch: List[str], caller: str) -> List[List[float]]:
+        started = time.perf_counter()
+        response = await self._post(
+            self.embed_pool,
+            "/api/embed",
+            json={
+                "model": self.embedding_model,
+                "keep_alive": self.keep_alive,
+                "input": batch
+            },
+            timeout=self.embed_timeout
+        )
+        if response.status_code == 404:
+            # Ollama before 0.3 has no batch endpoint; embed each text concurrently instead
+            async def embed_one(text: str) -> List[float]:
+                single_started = time.perf_counter()
+                single = await self._post(
+                    self.embed_pool,
+                    "/api/embeddings",
+                    json={"model": self.embedding_model, "prompt": text, "keep_alive": self.keep_alive},
+                    timeout=self.embed_timeout
+                )
+                single.raise_for_status()
+                data = single.json()
+                llm_metrics.record("embed", caller, data, time.perf_counter() - single_started)
+                return data.get("embedding", [])
+            
+            return list(await asyncio.gather(*(embed_one(text) for text in batch)))
+        response.raise_for_status()
+        data = response.json()
+        llm_metrics.record("embed", caller, data, time.perf_counter() - started)
+        return data.get("embeddings", [])
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        priority: Optional[str] = "interactive",
+        coalesce: Optional[bool] = None,
+        caller: str = "other"
+    ) -> str:
+        """Chat with Ollama; coalesced, labelled and failing like generate"""
+        return await self.coalesce(
+            "chat",
+            (self.model, priority, temperature, json.dumps(messages, sort_keys=True)),
+            lambda: self._chat(messages, temperature, priority, caller),
+            self._is_deterministic(temperature, coalesce)
+        )
+
+    async def _chat(self, messages: List[Dict[str, str]], temperature: float, priority: Optional[str], caller: str) -> str:
+        self.check_available("chat")
+        async with self.admission(priority):
+            try:
+                started = time.perf_counter()
+                response = await self._post(
+                    self.chat_pool,
+                    "/api/chat",
                     json={
                         "model": self.model,
+                        "keep_alive": self.keep_alive,
                         "messages": messages,
                         "stream": False,
                         "options": {
                             "temperature": temperature
                         }
-                    }
+                    },
+                    timeout=self.generate_timeout
                 )
                 response.raise_for_status()
-                return response.json().get("message", {}).get("content", "")
-        except Exception as e:
-            print(f"Ollama chat error: {str(e)}")
-            return ""
+                data = response.json()
+                llm_metrics.record("chat", caller, data, time.perf_counter() - started)
+                return data.get("message", {}).get("content", "")
+            except OverloadedError:
+                raise
+            except Exception as e:
+                print(f"Ollama chat error: {str(e)}")
+                llm_metrics.record_error("chat", caller)
+                raise OllamaUnavailableError(UNAVAILABLE_DETAIL) from e
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        priority: Optional[str] = "interactive",
+        caller: str = "other"
+    ) -> AsyncIterator[str]:
+        """Chat with Ollama, yielding content tokens as they are generated.
+        
+        Raises CircuitOpenError (an OverloadedError) while the chat circuit is
+        open, and StreamInterruptedError if the stream ends before Ollama's
+        final "done" line - the tokens yielded so far are then incomplete.
+        """
+        self.check_available("chat")
+        async with self.admission(priority):
+            breaker = self.breakers["chat"]
+            backend = self.chat_pool.pick()
+            trial = breaker.acquire()
+            try:
+                started = time.perf_counter()
+                async with self.chat_pool.track(backend), self.client.stream(
+                    "POST",
+                    f"{backend.url}/api/chat",
+                    json={
+                        "model": self.model,
+                        "keep_alive": self.keep_alive,
+                        "messages": messages,
+                        "stream": True,
+                        "options": {
+                            "temperature": temperature
+                        }
+                    },
+                    timeout=self.generate_timeout
+                ) as response:
+                    self.chat_pool.record_response(backend, response)
+                    breaker.record(response.status_code < 500, trial)
+                    trial = None
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        if "error" in data:
+                            # Ollama reports failures after the headers as an NDJSON error line
+                            raise StreamInterruptedError(data["error"])
+                        content = data.get("message", {}).get("content", "")
+                        if content:
+                            yield content
+                        if data.get("done"):
+                            # The final line carries the token counts and timings
+                            llm_metrics.record("chat", caller, data, time.perf_counter() - started)
+                            return
+                    raise StreamInterruptedError("stream ended without a done line")
+            except Exception as e:
+                if trial is not None and isinstance(e, httpx.TransportError):
+                    breaker.record(False, trial)
+                    trial = None
+                print(f"Ollama chat stream error: {str(e)}")
+                llm_metrics.record_error("chat", caller)
+                if isinstance(e, StreamInterruptedError):
+                    raise
+                raise StreamInterruptedError(str(e)) from e
+            finally:
+                if trial is not None:
+                    breaker.release(trial)
 
 ollama_service = OllamaService()
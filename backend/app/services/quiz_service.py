@@ -2,6 +2,8 @@ from typing import List, Dict
 import json
 from app.services.ollama_service import ollama_service
 from app.services.rag_service import rag_service
+from app.services.context_builder import context_builder
+from app.core.config import settings
 
 class QuizService:
     
@@ -21,13 +23,17 @@ class QuizService:
         else:
             context_query = "Provide a summary of the main topics in this course"
         
+        # Embed the query once; it is reused by the unfiltered fallback search
+        query_embedding = await rag_service.embed_query(context_query)
+        
         # Search course materials - only from selected materials if provided
         print(f"Searching for quiz content with material_ids: {material_ids}")
         relevant_docs = await rag_service.search_vector_store(
             course_id, 
             context_query, 
-            top_k=5,
-            material_ids=material_ids
+            top_k=max(5, settings.RAG_RETRIEVAL_CANDIDATES),
+            material_ids=material_ids,
+            query_embedding=query_embedding
         )
         
         print(f"Found {len(relevant_docs)} relevant documents")
@@ -39,8 +45,9 @@ class QuizService:
                 relevant_docs = await rag_service.search_vector_store(
                     course_id, 
                     context_query, 
-                    top_k=5,
-                    material_ids=None
+                    top_k=max(5, settings.RAG_RETRIEVAL_CANDIDATES),
+                    material_ids=None,
+                    query_embedding=query_embedding
                 )
                 
             if not relevant_docs:
@@ -48,11 +55,9 @@ class QuizService:
                     "error": "No course materials found to generate quiz. Please ensure materials are uploaded and vector stores are created. Check backend logs for details."
                 }
         
-        # Build context
-        context = "\n\n".join([doc["content"] for doc in relevant_docs])
-        
         # Create prompt for quiz generation
-        prompt = f"""You are an expert educator. Generate EXACTLY {num_questions} quiz questions based on the following course material.
+        def build_prompt(context: str) -> str:
+            return f"""You are an expert educator. Generate EXACTLY {num_questions} quiz questions based on the following course material.
 
 Course Material:
 {context}
@@ -82,9 +87,18 @@ IMPORTANT: You MUST respond with ONLY valid JSON in this exact format (no other
 
 Generate {num_questions} questions now as JSON only:"""
         
+        # Build deduplicated, diversified context within the quiz token budget
+        context, _, _ = context_builder.build(
+            relevant_docs,
+            query_embedding,
+            prompt_tokens=context_builder.count_tokens(build_prompt("")),
+            token_budget=settings.QUIZ_CONTEXT_TOKEN_BUDGET
+        )
+        prompt = build_prompt(context)
+        
         # Generate quiz with JSON format enforced
         print("Sending prompt to AI with JSON format...")
-        response = await ollama_service.generate(prompt, temperature=0.7, format="json")
+        response = await ollama_service.generate(prompt, temperature=0.7, format="json", caller="quiz_generate")
         print(f"Received response (first 500 chars): {response[:500]}")
         
         try:
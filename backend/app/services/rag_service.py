@@ -1,15 +1,36 @@
 import os
+import time
+import asyncio
+import threading
 import faiss
 import numpy as np
-import pickle
-from typing import List, Dict, Tuple
+import json
+from collections import deque
+from typing import List, Dict, Tuple, Iterable, Iterator, AsyncIterator, Callable
 from pathlib import Path
 from pypdf import PdfReader
-from docx import Document
 
 from app.core.config import settings
-from app.services.ollama_service import ollama_service
+from app.services.ollama_service import ollama_service, OllamaUnavailableError, StreamInterruptedError
+from app.services.admission_scheduler import OverloadedError
 from app.services.moderation_service import moderation_service
+from app.services.vector_store_cache import vector_store_cache
+from app.services.embedding_cache import embedding_cache
+from app.services.chunk_store import ChunkStore
+from app.services.course_store import CourseStore, SegmentWriter, STORE_FORMAT
+from app.services.vector_index import vector_index_builder
+from app.services.answer_cache import answer_cache
+from app.services.blocking_executor import blocking_executor
+from app.services.micro_batcher import MicroBatcher
+from app.services.context_builder import context_builder
+from app.services.document_parser import extract_pdf_pages, extract_docx_paragraphs
+
+# Characters read per block from plain-text files
+TEXT_BLOCK_SIZE = 64 * 1024
+# Reads of a store that was replaced mid-read before giving up
+STORE_READ_ATTEMPTS = 3
+# Characters of new streamed answer text between moderation passes
+STREAM_MODERATION_INTERVAL = 200
 
 class RAGService:
     def __init__(self):
@@ -17,219 +38,761 @@ class RAGService:
         self.vector_store_path.mkdir(exist_ok=True)
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
+        self._store_locks: Dict[int, threading.Lock] = {}
+        self._store_locks_guard = threading.Lock()
+        # Concurrent queries share one embedding call and one multi-row search per course
+        self.embed_batcher = MicroBatcher(
+            self._embed_query_batch, settings.RETRIEVAL_BATCH_WINDOW_MS, settings.RETRIEVAL_BATCH_MAX_SIZE
+        )
+        self.search_batcher = MicroBatcher(
+            self._search_batch, settings.RETRIEVAL_BATCH_WINDOW_MS, settings.RETRIEVAL_BATCH_MAX_SIZE
+        )
 
-    def extract_text_from_file(self, file_path: str) -> str:
-        """Extract text from PDF, DOCX, or TXT files"""
+    async def aiter_text_from_file(self, file_path: str) -> AsyncIterator[str]:
+        """Yield text from PDF, DOCX, or TXT files a page/paragraph/block at a time.
+        
+        PDF and DOCX parsing runs in the parsing process pool; PDFs are split into
+        page ranges so a few are parsed ahead while earlier pages are consumed.
+        Parse results are awaited here on the event loop, never inside a pool
+        thread, so ingestion can't tie up the I/O threads searches need.
+        """
         file_extension = Path(file_path).suffix.lower()
         
+        if file_extension == '.pdf':
+            num_pages = await blocking_executor.run(lambda: len(PdfReader(file_path).pages))
+            pages_per_task = settings.DOCUMENT_PARSE_PAGES_PER_TASK
+            lookahead = max(1, blocking_executor.parse_processes)
+            ranges = iter(range(0, num_pages, pages_per_task))
+            pending = deque()
+            try:
+                while True:
+                    while len(pending) < lookahead:
+                        start = next(ranges, None)
+                        if start is None:
+                            break
+                        pending.append(asyncio.wrap_future(blocking_executor.submit_parse(
+                            extract_pdf_pages, file_path, start, start + pages_per_task
+                        )))
+                    if not pending:
+                        break
+                    for page in await pending.popleft():
+                        yield page
+            finally:
+                for future in pending:
+                    future.cancel()
+        
+        elif file_extension == '.docx':
+            for paragraph in await blocking_executor.run_parse(extract_docx_paragraphs, file_path):
+                yield paragraph
+        
+        elif file_extension == '.txt':
+            with open(file_path, 'r', encoding='utf-8') as f:
+                while True:
+                    block = await blocking_executor.run(f.read, TEXT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+
+    def extract_text_from_file(self, file_path: str) -> str:
+        """Extract text from PDF, DOCX, or TXT files (blocking, parses in the calling thread)"""
         try:
+            file_extension = Path(file_path).suffix.lower()
             if file_extension == '.pdf':
-                reader = PdfReader(file_path)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-            
-            elif file_extension == '.docx':
-                doc = Document(file_path)
-                text = ""
-                for paragraph in doc.paragraphs:
-                    text += paragraph.text + "\n"
-                return text
-            
-            elif file_extension == '.txt':
+                return "".join(extract_pdf_pages(file_path, 0, len(PdfReader(file_path).pages)))
+            if file_extension == '.docx':
+                return "".join(extract_docx_paragraphs(file_path))
+            if file_extension == '.txt':
                 with open(file_path, 'r', encoding='utf-8') as f:
                     return f.read()
-            
-            else:
-                return ""
+            return ""
         except Exception as e:
             print(f"Error extracting text from {file_path}: {str(e)}")
             return ""
 
-    def chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks with overlap"""
+    def _take_chunks(self, buffer: str, final: bool = False) -> Tuple[List[str], str]:
+        """Cut the complete overlapping chunks off buffer (all of it if final); returns (chunks, rest)"""
+        step = self.chunk_size - self.chunk_overlap
         chunks = []
         start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + self.chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += self.chunk_size - self.chunk_overlap
+        if final:
+            while start < len(buffer):
+                chunks.append(buffer[start:start + self.chunk_size])
+                start += step
+            return chunks, ""
+        while len(buffer) - start >= self.chunk_size:
+            chunks.append(buffer[start:start + self.chunk_size])
+            start += step
+        return chunks, buffer[start:]
+
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[str]:
+        """Split a stream of text into overlapping chunks without materializing the whole text"""
+        buffer = ""
+        for piece in pieces:
+            chunks, buffer = self._take_chunks(buffer + piece)
+            yield from chunks
+        yield from self._take_chunks(buffer, final=True)[0]
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into chunks with overlap"""
+        return list(self.iter_chunks([text]))
+
+    async def aiter_file_chunks(self, file_path: str) -> AsyncIterator[str]:
+        """Parse and chunk a file, yielding chunks as they are produced.
         
-        return chunks
+        Parsing only runs ahead of the consumer (typically embedding) by the
+        page ranges in flight, so a large file is never held in memory whole.
+        """
+        buffer = ""
+        pieces = self.aiter_text_from_file(file_path)
+        try:
+            async for piece in pieces:
+                chunks, buffer = self._take_chunks(buffer + piece)
+                for chunk in chunks:
+                    yield chunk
+            for chunk in self._take_chunks(buffer, final=True)[0]:
+                yield chunk
+        finally:
+            # Cancel parse-ahead if the consumer stopped early
+            await pieces.aclose()
 
-    async def create_vector_store(self, course_id: int, file_path: str, material_title: str) -> str:
-        """Create FAISS vector store from document"""
-        # Extract text
-        text = self.extract_text_from_file(file_path)
-        if not text:
-            raise ValueError("Could not extract text from file")
+    async def embed_file(self, file_path: str, on_progress: Callable = None) -> SegmentWriter:
+        """Chunk and embed a file, embedding each slice while the next one is being parsed.
         
-        # Chunk text
-        chunks = self.chunk_text(text)
+        Embedded slices are appended to a pending segment on disk as they
+        complete; the caller hands it to add_material_to_store and must
+        discard() it afterwards. on_progress(embedded_chunks, parsed_chunks,
+        parsing_done) is awaited after every slice.
+        """
+        slice_size = settings.OLLAMA_EMBED_BATCH_SIZE * settings.OLLAMA_EMBED_CONCURRENCY
+        segment = self.new_segment()
+        parsed = 0
+        pending = None
+        batch = []
         
-        # Generate embeddings
-        embeddings = []
-        for chunk in chunks:
-            embedding = await ollama_service.embed(chunk)
-            if embedding:
-                embeddings.append(embedding)
+        async def finish(slice_chunks, task):
+            await blocking_executor.run(segment.append, slice_chunks, await task)
+            if on_progress:
+                await on_progress(segment.num_rows, parsed, False)
         
-        if not embeddings:
-            raise ValueError("Could not generate embeddings")
+        file_chunks = self.aiter_file_chunks(file_path)
+        try:
+            try:
+                async for chunk in file_chunks:
+                    parsed += 1
+                    batch.append(chunk)
+                    if len(batch) >= slice_size:
+                        if pending:
+                            await finish(*pending)
+                        pending = (batch, asyncio.create_task(self.embed_chunks(batch)))
+                        batch = []
+                
+                if pending:
+                    await finish(*pending)
+                    pending = None
+            finally:
+                await file_chunks.aclose()
+                # A parse error (or cancellation) must not leave the slice embedding for a failed job
+                if pending:
+                    pending[1].cancel()
+                    await asyncio.gather(pending[1], return_exceptions=True)
+            if batch:
+                await blocking_executor.run(segment.append, batch, await self.embed_chunks(batch))
+            await blocking_executor.run(segment.finish)
+        except BaseException:
+            segment.discard()
+            raise
+        if on_progress:
+            await on_progress(segment.num_rows, parsed, True)
         
-        # Create FAISS index
-        dimension = len(embeddings[0])
-        index = faiss.IndexFlatL2(dimension)
-        embeddings_array = np.array(embeddings).astype('float32')
-        index.add(embeddings_array)
+        return segment
+
+    def course_store_id(self, course_id: int) -> str:
+        """Identifier of the consolidated vector store for a course"""
+        return f"course_{course_id}"
+
+    def _metadata_path(self, vector_store_id: str) -> Path:
+        """The store's manifest: it names the index file, so the two always change together"""
+        return self.vector_store_path / f"{vector_store_id}_metadata.json"
+
+    def _index_path(self, vector_store_id: str, metadata: Dict) -> Path:
+        # Stores written before index files were versioned use the fixed name
+        return self.vector_store_path / metadata.get("index_file", f"{vector_store_id}.index")
+
+    def _store_lock(self, course_id: int) -> threading.Lock:
+        """Serializes writers (ingestion, removal, compaction) of one course store"""
+        with self._store_locks_guard:
+            return self._store_locks.setdefault(course_id, threading.Lock())
+
+    def _read_metadata(self, vector_store_id: str) -> Dict:
+        with open(self._metadata_path(vector_store_id), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        if metadata.get("format") != STORE_FORMAT:
+            raise ValueError(f"{vector_store_id} uses an old layout; run migrate_vector_stores.py")
+        # JSON object keys are strings; material and segment IDs are ints everywhere else
+        metadata["materials"] = {int(k): v for k, v in metadata["materials"].items()}
+        metadata["segments"] = {int(k): v for k, v in metadata["segments"].items()}
+        return metadata
+
+    def _read_store(self, vector_store_id: str) -> CourseStore:
+        """Read a store straight from disk, bypassing the cache"""
+        for attempt in range(STORE_READ_ATTEMPTS):
+            version = self._version(vector_store_id)
+            metadata = self._read_metadata(vector_store_id)
+            index_path = self._index_path(vector_store_id, metadata)
+            try:
+                index_bytes = index_path.stat().st_size
+                index = faiss.read_index(str(index_path))
+                return CourseStore(index, metadata, self.vector_store_path, index_bytes)
+            except (OSError, RuntimeError):
+                # A writer replaced the store (deleting files we were about to open); read the new version
+                if attempt == STORE_READ_ATTEMPTS - 1 or self._version(vector_store_id) == version:
+                    raise
+
+    def _new_metadata(self, course_id: int) -> Dict:
+        return {
+            "format": STORE_FORMAT,
+            "course_id": course_id,
+            "next_id": 0,
+            "next_segment": 0,
+            "segments": {},
+            "materials": {},
+            "tombstones": [],
+            "dead_vectors": 0
+        }
+
+    def _write_store(self, vector_store_id: str, metadata: Dict, index=None):
+        """Persist metadata (and the index, if given) atomically and drop any cached copy.
         
-        # Save index and metadata
-        vector_store_id = f"course_{course_id}_{material_title.replace(' ', '_')}"
-        index_path = self.vector_store_path / f"{vector_store_id}.index"
-        metadata_path = self.vector_store_path / f"{vector_store_id}_metadata.pkl"
+        A new index goes to a new versioned file that only the new metadata names,
+        so readers always see a matching pair; the old index file is then deleted.
+        """
+        metadata_path = self._metadata_path(vector_store_id)
         
-        faiss.write_index(index, str(index_path))
+        old_index_path = None
+        if index is not None:
+            old_index_path = self._index_path(vector_store_id, metadata)
+            metadata["index_version"] = metadata.get("index_version", 0) + 1
+            metadata["index_file"] = f"{vector_store_id}_v{metadata['index_version']}.index"
+            faiss.write_index(index, str(self.vector_store_path / metadata["index_file"]))
         
-        metadata = {
-            "chunks": chunks,
-            "course_id": course_id,
-            "material_title": material_title
-        }
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(metadata, f)
+        tmp_metadata_path = metadata_path.with_suffix(".json.tmp")
+        with open(tmp_metadata_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                **metadata,
+                "materials": {str(k): v for k, v in metadata["materials"].items()},
+                "segments": {str(k): v for k, v in metadata["segments"].items()}
+            }, f)
+        os.replace(tmp_metadata_path, metadata_path)
+        if old_index_path is not None:
+            self._delete_files([old_index_path.name])
         
-        return vector_store_id
+        vector_store_cache.invalidate(vector_store_id)
+        answer_cache.invalidate_course(metadata["course_id"])
+
+    def new_segment(self) -> SegmentWriter:
+        return SegmentWriter(
+            self.vector_store_path,
+            compress=settings.CHUNK_STORE_COMPRESSION,
+            rows_per_block=settings.CHUNK_STORE_BLOCK_ROWS
+        )
 
-    async def search_vector_store(self, course_id: int, query: str, top_k: int = 3, material_ids: List[int] = None) -> List[Dict]:
-        """Search vector store for relevant documents, optionally filtered by material_ids"""
-        from app.core.database import SessionLocal
-        from app.models.course import CourseMaterial
+    def _write_segment(self, vector_store_id: str, metadata: Dict, segment: SegmentWriter) -> int:
+        """Move a finished segment's files into place as a new immutable segment.
         
-        # If material_ids provided, get their vector_store_ids
-        allowed_store_ids = None
-        if material_ids:
-            db = SessionLocal()
+        Segments are never modified in place, so readers that still have an
+        older one memory-mapped are unaffected by concurrent writes.
+        """
+        segment_id = metadata["next_segment"]
+        metadata["next_segment"] += 1
+        chunk_file = f"{vector_store_id}_seg{segment_id}.chunks"
+        vector_file = f"{vector_store_id}_seg{segment_id}.vectors.npy"
+        os.replace(segment.chunk_path, self.vector_store_path / chunk_file)
+        os.replace(segment.vector_path, self.vector_store_path / vector_file)
+        metadata["segments"][segment_id] = {
+            "chunk_file": chunk_file,
+            "vector_file": vector_file,
+            "num_rows": segment.num_rows
+        }
+        return segment_id
+
+    def _delete_files(self, file_names: Iterable[str]):
+        # Best effort: a file may still be mapped (and locked on Windows)
+        for file_name in file_names:
             try:
-                materials = db.query(CourseMaterial).filter(
-                    CourseMaterial.id.in_(material_ids),
-                    CourseMaterial.course_id == course_id
-                ).all()
-                allowed_store_ids = {m.vector_store_id for m in materials if m.vector_store_id}
-                print(f"Filtering by material_ids: {material_ids}")
-                print(f"Allowed vector_store_ids: {allowed_store_ids}")
-            finally:
-                db.close()
-        
-        # Find all vector stores for this course
-        course_stores = list(self.vector_store_path.glob(f"course_{course_id}_*.index"))
-        print(f"Found {len(course_stores)} vector stores for course {course_id}")
+                (self.vector_store_path / file_name).unlink()
+            except OSError:
+                pass
+
+    def _tombstone(self, metadata: Dict, material_id: int) -> List[str]:
+        """Mark a material's vectors dead; returns segment files that are no longer referenced"""
+        material = metadata["materials"].pop(material_id, None)
+        if not material:
+            return []
+        metadata["tombstones"].append({
+            "material_id": material_id,
+            "first_id": material["first_id"],
+            "num_chunks": material["num_chunks"]
+        })
+        metadata["dead_vectors"] += material["num_chunks"]
         
-        if not course_stores:
-            print(f"No vector stores found for course {course_id}!")
-            print(f"Searched in: {self.vector_store_path}")
-            print(f"Pattern: course_{course_id}_*.index")
+        segment_id = material["segment"]
+        if any(m["segment"] == segment_id for m in metadata["materials"].values()):
             return []
+        segment = metadata["segments"].pop(segment_id)
+        return [segment["chunk_file"], segment["vector_file"]]
+
+    def _dead_ratio(self, metadata: Dict) -> float:
+        live = sum(material["num_chunks"] for material in metadata["materials"].values())
+        total = live + metadata["dead_vectors"]
+        return metadata["dead_vectors"] / total if total else 0.0
+
+    def _needs_rebuild(self, metadata: Dict, index, num_live: int) -> bool:
+        """Whether the index must be rebuilt rather than appended to"""
+        if index is None:
+            return True
+        if vector_index_builder.choose_type(num_live) != metadata.get("index_type"):
+            return True
+        # Compare with what a build would use now: PQ and PCA fall back on small corpora
+        compression, pca_dim = vector_index_builder.resolve(num_live, index.d)
+        if compression != metadata.get("compression") or pca_dim != metadata.get("pca_dim", 0):
+            return True
+        # Retrain IVF centroids / PCA once the corpus has doubled since training
+        trained = metadata.get("index_type") == "ivf" or metadata.get("pca_dim")
+        return bool(trained) and num_live > 2 * metadata.get("trained_on", 0)
+
+    def _build_index(self, vector_store_id: str, vectors: np.ndarray, ids: np.ndarray) -> Tuple:
+        """Build a fresh index for the corpus; returns (index, description with recall)"""
+        index, description = vector_index_builder.build(vectors, ids)
+        description["trained_on"] = len(ids)
+        description["recall"] = None
+        if description["index_type"] != "flat" or description["compression"] != "none" or description["pca_dim"]:
+            recall = vector_index_builder.measure_recall(index, vectors, ids)
+            if description["compression"] != "none" or description["pca_dim"]:
+                # Compare against the same index type with full float32 vectors
+                reference, _ = vector_index_builder.build(
+                    vectors, ids, index_type=description["index_type"], compression="none", pca_dim=0
+                )
+                recall["uncompressed_recall"] = vector_index_builder.measure_recall(reference, vectors, ids)["recall"]
+                recall["recall_delta"] = recall["recall"] - recall["uncompressed_recall"]
+            description["recall"] = recall
+            print(f"{vector_store_id}: {description} over {len(ids)} vectors")
+        return index, description
+
+    async def create_vector_store(self, course_id: int, file_path: str, material_title: str, material_id: int) -> str:
+        """Index a document into its course's consolidated FAISS vector store"""
+        # Stream, chunk and embed; failures raise instead of dropping chunks
+        segment = await self.embed_file(file_path)
+        try:
+            if not segment.num_rows:
+                raise ValueError("Could not extract text from file")
+            return await blocking_executor.run(
+                self.add_material_to_store, course_id, material_id, material_title, segment
+            )
+        finally:
+            segment.discard()
+
+    def add_material_to_store(
+        self,
+        course_id: int,
+        material_id: int,
+        material_title: str,
+        segment: SegmentWriter
+    ) -> str:
+        """Add a material's finished segment (from embed_file) to its course store.
+        
+        Blocking (FAISS and file I/O): call it through blocking_executor from async code.
         
-        all_results = []
+        Vectors are appended to the existing index; a previous version of the
+        material is tombstoned. The index is only rebuilt when the corpus size
+        calls for a different index type, or when dead vectors pass the
+        compaction threshold.
+        """
+        vector_store_id = self.course_store_id(course_id)
+        num_chunks = segment.num_rows
         
-        for store_path in course_stores:
-            # Extract the vector_store_id from filename
-            # Filename format: "course_{course_id}_{material_title}.index"
-            # We need the full ID: "course_{course_id}_{material_title}" (which is store_path.stem)
-            vector_store_id = store_path.stem  # This is the full ID stored in database
+        with self._store_lock(course_id):
+            if self._metadata_path(vector_store_id).exists():
+                metadata = self._read_metadata(vector_store_id)
+                index = faiss.read_index(str(self._index_path(vector_store_id, metadata)))
+            else:
+                metadata = self._new_metadata(course_id)
+                index = None
             
-            print(f"Processing store file: {store_path.name}")
-            print(f"Extracted vector_store_id: {vector_store_id}")
+            # Re-uploading a material replaces its previous version
+            obsolete_files = self._tombstone(metadata, material_id)
             
-            # If material filtering is enabled, check if this store is allowed
-            if allowed_store_ids is not None:
-                if vector_store_id not in allowed_store_ids:
-                    print(f"Store {vector_store_id} not in allowed list, skipping")
-                    continue
-                print(f"Store {vector_store_id} is in allowed list, processing")
-                
-            try:
-                # Load index and metadata
-                index = faiss.read_index(str(store_path))
-                metadata_path = self.vector_store_path / f"{vector_store_id}_metadata.pkl"
-                
-                if not metadata_path.exists():
-                    print(f"Metadata file not found: {metadata_path}")
-                    continue
-                
-                with open(metadata_path, 'rb') as f:
-                    metadata = pickle.load(f)
-                
-                # Generate query embedding
-                query_embedding = await ollama_service.embed(query)
-                if not query_embedding:
-                    print("Failed to generate query embedding")
+            segment_id = self._write_segment(vector_store_id, metadata, segment)
+            first_id = metadata["next_id"]
+            metadata["next_id"] += num_chunks
+            metadata["materials"][material_id] = {
+                "title": material_title,
+                "segment": segment_id,
+                "row": 0,
+                "first_id": first_id,
+                "num_chunks": num_chunks
+            }
+            
+            num_live = sum(material["num_chunks"] for material in metadata["materials"].values())
+            if self._needs_rebuild(metadata, index, num_live) or \
+                    self._dead_ratio(metadata) > settings.VECTOR_STORE_COMPACTION_DEAD_RATIO:
+                obsolete_files += self._compact(vector_store_id, metadata)
+            else:
+                vectors = np.load(self.vector_store_path / metadata["segments"][segment_id]["vector_file"], mmap_mode='r')
+                index.add_with_ids(vectors, np.arange(first_id, first_id + num_chunks, dtype='int64'))
+                self._write_store(vector_store_id, metadata, index)
+            
+            self._delete_files(obsolete_files)
+        
+        return vector_store_id
+
+    def remove_material_from_store(self, course_id: int, material_id: int) -> bool:
+        """Tombstone a material's vectors; returns True if the store now needs compaction"""
+        vector_store_id = self.course_store_id(course_id)
+        
+        with self._store_lock(course_id):
+            if not self._metadata_path(vector_store_id).exists():
+                return False
+            metadata = self._read_metadata(vector_store_id)
+            if material_id not in metadata["materials"]:
+                return False
+            
+            obsolete_files = self._tombstone(metadata, material_id)
+            if not metadata["materials"]:
+                # Nothing live is left; drop the store entirely
+                self._delete_store_files(vector_store_id)
+                return False
+            
+            self._write_store(vector_store_id, metadata)
+            self._delete_files(obsolete_files)
+            return self._dead_ratio(metadata) > settings.VECTOR_STORE_COMPACTION_DEAD_RATIO
+
+    def compact_store(self, course_id: int):
+        """Rewrite a course store without its tombstoned vectors"""
+        vector_store_id = self.course_store_id(course_id)
+        
+        with self._store_lock(course_id):
+            if not self._metadata_path(vector_store_id).exists():
+                return
+            metadata = self._read_metadata(vector_store_id)
+            obsolete_files = self._compact(vector_store_id, metadata)
+            self._delete_files(obsolete_files)
+
+    def _compact(self, vector_store_id: str, metadata: Dict) -> List[str]:
+        """Merge live materials into one segment and rebuild the index; returns obsolete files"""
+        segment = self.new_segment()
+        materials = {}
+        try:
+            for material_id, material in sorted(metadata["materials"].items(), key=lambda m: m[1]["first_id"]):
+                source = metadata["segments"][material["segment"]]
+                chunk_store = ChunkStore(self.vector_store_path / source["chunk_file"])
+                source_vectors = np.load(self.vector_store_path / source["vector_file"], mmap_mode='r')
+                rows = range(material["row"], material["row"] + material["num_chunks"])
+                materials[material_id] = {
+                    **material,
+                    "row": segment.num_rows,
+                    "first_id": segment.num_rows
+                }
+                segment.append([chunk_store.get(row) for row in rows], source_vectors[rows.start:rows.stop])
+            segment.finish()
+            
+            num_rows = segment.num_rows
+            vectors = segment.vectors()
+            index, description = self._build_index(vector_store_id, vectors, np.arange(num_rows, dtype='int64'))
+            # Unmap before the pending file is renamed
+            del vectors
+            
+            obsolete_files = [
+                file_name
+                for source in metadata["segments"].values()
+                for file_name in (source["chunk_file"], source["vector_file"])
+            ]
+            metadata["segments"] = {}
+            segment_id = self._write_segment(vector_store_id, metadata, segment)
+        finally:
+            segment.discard()
+        for material in materials.values():
+            material["segment"] = segment_id
+        metadata.update(description)
+        metadata.update({
+            "materials": materials,
+            "tombstones": [],
+            "dead_vectors": 0,
+            "next_id": num_rows
+        })
+        
+        self._write_store(vector_store_id, metadata, index)
+        print(f"Rebuilt {vector_store_id} from {num_rows} live vectors")
+        return obsolete_files
+
+    def delete_course_store(self, course_id: int):
+        """Delete a course's vector store and everything cached from it"""
+        with self._store_lock(course_id):
+            self._delete_store_files(self.course_store_id(course_id))
+        answer_cache.invalidate_course(course_id)
+
+    def _delete_store_files(self, vector_store_id: str):
+        # Metadata first, so readers see no store rather than a partial one
+        self._delete_files([
+            self._metadata_path(vector_store_id).name,
+            f"{vector_store_id}.index",
+            *(path.name for path in self.vector_store_path.glob(f"{vector_store_id}_v*.index")),
+            *(path.name for path in self.vector_store_path.glob(f"{vector_store_id}_seg*"))
+        ])
+        vector_store_cache.invalidate(vector_store_id)
+
+    async def embed_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Embed chunks into an (n, dimension) float32 array, reusing cached embeddings of identical text"""
+        model = ollama_service.embedding_model
+        cached = await blocking_executor.run(embedding_cache.get_many, model, chunks)
+        
+        missing = []
+        seen = set()
+        for chunk in chunks:
+            chunk_hash = embedding_cache.hash_text(chunk)
+            if chunk_hash not in cached and chunk_hash not in seen:
+                seen.add(chunk_hash)
+                missing.append(chunk)
+        
+        if missing:
+            new_embeddings = np.asarray(
+                await ollama_service.embed_batch(missing, caller="ingestion"), dtype="float32"
+            )
+            await blocking_executor.run(embedding_cache.put_many, model, missing, new_embeddings)
+            for chunk, embedding in zip(missing, new_embeddings):
+                cached[embedding_cache.hash_text(chunk)] = embedding
+        
+        print(f"Embedded {len(chunks)} chunks ({len(chunks) - len(missing)} from cache)")
+        return np.stack([cached[embedding_cache.hash_text(chunk)] for chunk in chunks])
+
+    def load_vector_store(self, vector_store_id: str) -> CourseStore:
+        """Load a store, served from the in-process cache when fresh"""
+        version = self._version(vector_store_id)
+        if version is None:
+            raise FileNotFoundError(f"Vector store not found: {vector_store_id}")
+        
+        def loader():
+            store = self._read_store(vector_store_id)
+            # The serialized index size tracks its in-memory size, including compression.
+            # Chunk text and vectors live in the page cache; only offsets count against the budget.
+            return store, store.index_bytes + store.resident_size()
+        
+        return vector_store_cache.get_or_load(vector_store_id, version, loader)
+
+    def store_version(self, course_id: int):
+        """Cheap version stamp of a course store; None if it doesn't exist"""
+        return self._version(self.course_store_id(course_id))
+
+    def _version(self, vector_store_id: str):
+        # Every write replaces the metadata file, which gives it a new inode
+        try:
+            stat = self._metadata_path(vector_store_id).stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def describe_vector_store(self, course_id: int) -> Dict:
+        """Summary of a course store: index type, size, materials, dead vectors and measured recall"""
+        vector_store_id = self.course_store_id(course_id)
+        store = self.load_vector_store(vector_store_id)
+        metadata = store.metadata
+        return {
+            "vector_store_id": vector_store_id,
+            "index_type": metadata.get("index_type", "flat"),
+            "compression": metadata.get("compression", "none"),
+            "pca_dim": metadata.get("pca_dim", 0),
+            "num_vectors": store.index.ntotal,
+            "live_vectors": store.live_count,
+            "dead_vectors": metadata["dead_vectors"],
+            "dead_ratio": self._dead_ratio(metadata),
+            "dimension": store.index.d,
+            "index_bytes": store.index_bytes,
+            "num_materials": len(metadata["materials"]),
+            "num_segments": len(metadata["segments"]),
+            "recall": metadata.get("recall")
+        }
+
+    async def embed_query(self, query: str) -> List[float]:
+        """Embed a query once so it can be reused across stores and repeated searches.
+        
+        Concurrent requests for the same query share one embedding call.
+        Raises OverloadedError (503 for OllamaUnavailableError) if it can't be embedded.
+        """
+        model = ollama_service.embedding_model
+        embedding = await ollama_service.coalesce(
+            "embed",
+            (model, "interactive", query),
+            lambda: self.embed_batcher.submit(model, query),
+            True
+        )
+        return list(embedding)
+
+    async def _embed_query_batch(self, model: str, queries: List[str]) -> List[List[float]]:
+        try:
+            # Batches mix queries from chat and quiz generation; users are waiting, so retry little
+            return await ollama_service.embed_batch(
+                queries, priority="interactive", caller="retrieval",
+                max_retries=settings.RETRIEVAL_EMBED_MAX_RETRIES
+            )
+        except OverloadedError:
+            raise
+        except Exception as e:
+            # Fail the request (503) rather than answer as if the course had no materials
+            print(f"Error embedding {len(queries)} queries: {str(e)}")
+            raise OllamaUnavailableError("The AI service could not process the question, please retry shortly") from e
+
+    async def search_vector_store(
+        self,
+        course_id: int,
+        query: str,
+        top_k: int = 3,
+        material_ids: List[int] = None,
+        query_embedding: List[float] = None
+    ) -> List[Dict]:
+        """Search the course vector store, optionally restricted to material_ids.
+        
+        Results carry the chunk's raw "embedding" for re-ranking (see context_builder).
+        Pass a precomputed query_embedding (see embed_query) to skip the embedding round-trip.
+        Concurrent searches of the same course and materials run as one batched search.
+        """
+        vector_store_id = self.course_store_id(course_id)
+        if self.store_version(course_id) is None:
+            print(f"No vector store found for course {course_id} in {self.vector_store_path}")
+            return []
+        
+        # Generate query embedding once
+        if query_embedding is None:
+            query_embedding = await self.embed_query(query)
+        if not query_embedding:
+            print("Failed to generate query embedding")
+            return []
+        
+        scope = (course_id, tuple(sorted(set(material_ids or []))))
+        results = await self.search_batcher.submit(scope, (query_embedding, top_k))
+        
+        print(f"Returning {len(results)} results from {vector_store_id}")
+        return results
+
+    async def _search_batch(self, scope: Tuple[int, Tuple[int, ...]], queries: List[Tuple[List[float], int]]) -> List[List[Dict]]:
+        course_id, material_ids = scope
+        return await blocking_executor.run(self._search_many, course_id, list(material_ids), queries)
+
+    def _search_many(self, course_id: int, material_ids: List[int], queries: List[Tuple[List[float], int]]) -> List[List[Dict]]:
+        """Search one course store for several (query_embedding, top_k) pairs with a single index.search"""
+        vector_store_id = self.course_store_id(course_id)
+        no_results = [[] for _ in queries]
+        try:
+            store = self.load_vector_store(vector_store_id)
+        except FileNotFoundError:
+            print(f"No vector store found for course {course_id} in {self.vector_store_path}")
+            return no_results
+        except ValueError as e:
+            print(f"Cannot search course {course_id}: {str(e)}")
+            return no_results
+        
+        # Restrict the search to the selected materials' live vector IDs, or
+        # otherwise just exclude tombstoned vectors still in the index
+        sel = None
+        if material_ids:
+            allowed_ids = store.live_ids(material_ids)
+            print(f"Filtering by material_ids: {material_ids} ({allowed_ids.size} vectors)")
+            if allowed_ids.size == 0:
+                return no_results
+            sel = faiss.IDSelectorBatch(allowed_ids.size, faiss.swig_ptr(allowed_ids))
+            available = allowed_ids.size
+        else:
+            if store.dead_ids.size:
+                dead = faiss.IDSelectorBatch(store.dead_ids.size, faiss.swig_ptr(store.dead_ids))
+                sel = faiss.IDSelectorNot(dead)
+            available = store.live_count
+        params = vector_index_builder.search_params(store.index, sel)
+        
+        k = min(max(top_k for _, top_k in queries), available)
+        if k == 0:
+            return no_results
+        query_vectors = np.array([embedding for embedding, _ in queries]).astype('float32')
+        
+        try:
+            distances, ids = store.index.search(query_vectors, k, params=params)
+        except Exception as e:
+            print(f"Error searching vector store {vector_store_id}: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return no_results
+        
+        batch_results = []
+        for row, (_, top_k) in enumerate(queries):
+            results = []
+            for distance, vector_id in zip(distances[row][:top_k], ids[row][:top_k]):
+                resolved = store.resolve(int(vector_id)) if vector_id >= 0 else None
+                if resolved is None:
                     continue
-                
-                # Search
-                query_vector = np.array([query_embedding]).astype('float32')
-                distances, indices = index.search(query_vector, min(top_k, len(metadata["chunks"])))
-                
-                print(f"Found {len(indices[0])} results from {vector_store_id}")
-                
-                # Collect results
-                for i, idx in enumerate(indices[0]):
-                    if idx < len(metadata["chunks"]):
-                        all_results.append({
-                            "content": metadata["chunks"][idx],
-                            "score": float(1 / (1 + distances[0][i])),  # Convert distance to similarity
-                            "metadata": {
-                                "material": metadata["material_title"],
-                                "course_id": metadata["course_id"]
-                            }
-                        })
-            except Exception as e:
-                print(f"Error searching vector store {store_path}: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                continue
-        
-        # Sort by score and return top k
-        all_results.sort(key=lambda x: x["score"], reverse=True)
-        print(f"Returning {len(all_results[:top_k])} total results")
-        return all_results[:top_k]
+                material_id, material, chunk_no = resolved
+                results.append({
+                    "content": store.chunk(material, chunk_no),
+                    "embedding": store.vector(material, chunk_no),
+                    "score": float(1 / (1 + distance)),  # Convert distance to similarity
+                    "metadata": {
+                        "material": material["title"],
+                        "material_id": material_id,
+                        "chunk": chunk_no,
+                        "course_id": store.metadata["course_id"]
+                    }
+                })
+            batch_results.append(results)
+        return batch_results
 
-    async def query(self, query: str, course_id: int, conversation_history: List[Dict] = None, material_ids: List[int] = None) -> Dict:
-        """Query the RAG system with optional material filtering"""
+    async def _prepare_answer(
+        self,
+        query: str,
+        course_id: int,
+        conversation_history: List[Dict] = None,
+        material_ids: List[int] = None
+    ) -> Dict:
+        """Moderate, check the answer cache and retrieve context for a query.
+        
+        Returns {"response": ...} when the query is answered without the LLM,
+        otherwise the chat messages and retrieval results needed to answer it.
+        """
         # Moderate the query
         moderation_result = await moderation_service.moderate_content(query)
         if not moderation_result["passed"]:
-            return {
+            return {"response": {
                 "answer": "I cannot respond to this query as it violates our content policy.",
                 "sources": [],
                 "confidence": 0.0,
                 "moderation_passed": False,
                 "moderation_warnings": moderation_result["warnings"]
-            }
+            }}
+        
+        # Answers are only reusable when they don't depend on a conversation
+        use_cache = not conversation_history
+        store_version = self.store_version(course_id) if use_cache else None
+        if use_cache:
+            cached = answer_cache.get_exact(course_id, material_ids, query, store_version)
+            if cached:
+                return {"response": cached}
+        
+        started = time.perf_counter()
+        query_embedding = await self.embed_query(query)
+        if use_cache and query_embedding:
+            cached = answer_cache.get_similar(course_id, material_ids, query_embedding, store_version)
+            if cached:
+                return {"response": cached}
         
         # Search for relevant documents - only from selected materials if provided
-        relevant_docs = await self.search_vector_store(course_id, query, top_k=3, material_ids=material_ids)
+        relevant_docs = await self.search_vector_store(
+            course_id, query, top_k=settings.RAG_RETRIEVAL_CANDIDATES,
+            material_ids=material_ids, query_embedding=query_embedding
+        )
         
         if not relevant_docs:
-            return {
+            return {"response": {
                 "answer": "I don't have enough information in the course materials to answer this question. Please ask your teacher to upload relevant materials.",
                 "sources": [],
                 "confidence": 0.0,
                 "moderation_passed": True,
                 "moderation_warnings": []
-            }
-        
-        # Build context from relevant documents
-        context = "\n\n".join([doc["content"] for doc in relevant_docs])
-        
-        # Build conversation history
-        messages = []
-        if conversation_history:
-            messages.extend(conversation_history[-5:])  # Last 5 messages for context
+            }}
         
         # Create prompt
         system_prompt = """You are a helpful AI Co-Instructor. Your role is to:
@@ -241,7 +804,8 @@ class RAGService:
 
 Use the following context to answer the student's question:"""
         
-        user_prompt = f"""{system_prompt}
+        def build_prompt(context: str) -> str:
+            return f"""{system_prompt}
 
 Context from course materials:
 {context}
@@ -250,30 +814,134 @@ Student Question: {query}
 
 Please provide a helpful, accurate answer based on the course materials."""
         
-        messages.append({"role": "user", "content": user_prompt})
+        # Pack deduplicated, diversified context and recent history (last 5 messages) into the token budget
+        context, history, context_docs = context_builder.build(
+            relevant_docs,
+            query_embedding,
+            prompt_tokens=context_builder.count_tokens(build_prompt("")),
+            history=(conversation_history or [])[-5:]
+        )
         
-        # Generate response
-        answer = await ollama_service.chat(messages)
-        
-        # Moderate the response
-        response_moderation = await moderation_service.moderate_content(answer)
-        
-        # Calculate confidence based on relevance scores
-        avg_confidence = sum(doc["score"] for doc in relevant_docs) / len(relevant_docs)
+        messages = list(history)
+        messages.append({"role": "user", "content": build_prompt(context)})
         
         return {
-            "answer": answer,
+            "messages": messages,
             "sources": [
                 {
                     "content": doc["content"][:200] + "...",  # Truncate for display
                     "score": doc["score"],
                     "metadata": doc["metadata"]
                 }
-                for doc in relevant_docs
+                for doc in context_docs
             ],
-            "confidence": avg_confidence,
+            # Calculate confidence based on relevance scores
+            "confidence": sum(doc["score"] for doc in context_docs) / len(context_docs),
+            "use_cache": use_cache,
+            "store_version": store_version,
+            "query_embedding": query_embedding,
+            "started": started
+        }
+
+    def _finish_answer(self, query: str, course_id: int, material_ids: List[int], plan: Dict, answer: str, response_moderation: Dict) -> Dict:
+        """Assemble the response for a generated answer and cache it if reusable"""
+        result = {
+            "answer": answer,
+            "sources": plan["sources"],
+            "confidence": plan["confidence"],
             "moderation_passed": response_moderation["passed"],
             "moderation_warnings": response_moderation["warnings"]
         }
+        
+        if plan["use_cache"] and answer and response_moderation["passed"]:
+            answer_cache.put(
+                course_id, material_ids, query, plan["query_embedding"], plan["store_version"],
+                result, time.perf_counter() - plan["started"]
+            )
+        
+        return result
+
+    async def query(self, query: str, course_id: int, conversation_history: List[Dict] = None, material_ids: List[int] = None) -> Dict:
+        """Query the RAG system with optional material filtering"""
+        plan = await self._prepare_answer(query, course_id, conversation_history, material_ids)
+        if "response" in plan:
+            return plan["response"]
+        
+        # Generate response
+        # A cacheable answer is shared with identical queries anyway, so identical concurrent ones can share the call
+        answer = await ollama_service.chat(plan["messages"], coalesce=plan["use_cache"], caller="rag_query")
+        
+        # Moderate the response
+        response_moderation = await moderation_service.moderate_content(answer)
+        
+        return self._finish_answer(query, course_id, material_ids, plan, answer, response_moderation)
+
+    async def query_stream(
+        self,
+        query: str,
+        course_id: int,
+        conversation_history: List[Dict] = None,
+        material_ids: List[int] = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """Stream a RAG answer as (event, data) pairs: sources, token..., then done.
+        
+        The growing answer is moderated every STREAM_MODERATION_INTERVAL characters;
+        if it fails, a "moderation" event is sent and the stream stops. Raises
+        OverloadedError (or CircuitOpenError) before the first event if the LLM
+        can't take the request; if the answer breaks off later, an "error" event
+        ends the stream and the partial answer is not cached.
+        """
+        plan = await self._prepare_answer(query, course_id, conversation_history, material_ids)
+        if "response" in plan:
+            response = plan["response"]
+            yield "sources", {"sources": response["sources"], "confidence": response["confidence"]}
+            if response["answer"]:
+                yield "token", {"content": response["answer"]}
+            yield "done", {
+                "moderation_passed": response["moderation_passed"],
+                "moderation_warnings": response["moderation_warnings"]
+            }
+            return
+        
+        # Get an LLM slot before the first event, so an overloaded or unavailable server can still refuse with 429/503
+        ollama_service.check_available("chat")
+        async with ollama_service.admission("interactive"):
+            yield "sources", {"sources": plan["sources"], "confidence": plan["confidence"]}
+            
+            answer = ""
+            moderated_length = 0
+            tokens = ollama_service.chat_stream(plan["messages"], priority=None, caller="rag_query")
+            try:
+                async for token in tokens:
+                    answer += token
+                    if len(answer) - moderated_length >= STREAM_MODERATION_INTERVAL:
+                        moderated_length = len(answer)
+                        partial_moderation = await moderation_service.moderate_content(answer)
+                        if not partial_moderation["passed"]:
+                            yield "moderation", {
+                                "moderation_passed": False,
+                                "moderation_warnings": partial_moderation["warnings"]
+                            }
+                            return
+                    yield "token", {"content": token}
+            except OverloadedError as e:
+                yield "error", {"detail": e.detail, "retry_after": e.retry_after}
+                return
+            except StreamInterruptedError:
+                yield "error", {"detail": "The answer was interrupted, please try again"}
+                return
+            finally:
+                await tokens.aclose()
+        
+        response_moderation = await moderation_service.moderate_content(answer)
+        if not response_moderation["passed"]:
+            yield "moderation", {
+                "moderation_passed": False,
+                "moderation_warnings": response_moderation["warnings"]
+            }
+            return
+        
+        self._finish_answer(query, course_id, material_ids, plan, answer, response_moderation)
+        yield "done", {"moderation_passed": True, "moderation_warnings": []}
 
 rag_service = RAGService()
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one.
+
+    The first caller for a key starts the call; callers arriving with the same
+    key while it is in flight wait for that call and get its result (or
+    exception). The call runs as its own task, so a caller that goes away
+    doesn't cancel it for the others; it is only cancelled once every caller
+    has gone. Nothing is kept after the call finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Dict] = {}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]], operation: str = "call") -> T:
+        metrics = self._metrics.setdefault(operation, {"upstream_calls": 0, "coalesced": 0})
+        call = self._calls.get(key)
+        if call is None:
+            call = {"task": asyncio.create_task(fn()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._forget(key, call))
+            metrics["upstream_calls"] += 1
+        else:
+            metrics["coalesced"] += 1
+
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        finally:
+            call["waiters"] -= 1
+            if call["waiters"] == 0 and not call["task"].done():
+                # Every caller was cancelled; new callers must start a fresh call
+                self._forget(key, call)
+                call["task"].cancel()
+
+    def _forget(self, key: Hashable, call: Dict):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict:
+        upstream = sum(metrics["upstream_calls"] for metrics in self._metrics.values())
+        coalesced = sum(metrics["coalesced"] for metrics in self._metrics.values())
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": upstream,
+            "coalesced": coalesced,
+            "saved_ratio": coalesced / (upstream + coalesced) if upstream + coalesced else 0.0,
+            "operations": {name: dict(metrics) for name, metrics in self._metrics.items()}
+        }
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+class SQLiteLRUCache:
+    """Size-bounded cache table in SQLite, shared by the embedding and generation caches.
+
+    WAL mode lets several uvicorn workers share the file. Subclasses define the
+    table (schema must include size and last_used columns) and its key columns;
+    once the stored sizes exceed max_bytes, least-recently-used rows are evicted.
+    """
+
+    table: str
+    key_columns: Tuple[str, ...]
+    schema: str
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.schema)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_last_used ON {self.table} (last_used)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self):
+        """Drop least-recently-used rows once over budget; call with the lock held"""
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Free down to 90% of the budget so we don't evict on every insert
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        columns = ", ".join(self.key_columns)
+        for *key, size in self._conn.execute(f"SELECT {columns}, size FROM {self.table} ORDER BY last_used ASC"):
+            victims.append(key)
+            freed += size
+            if freed >= to_free:
+                break
+        condition = " AND ".join(f"{column} = ?" for column in self.key_columns)
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE {condition}", victims)
+        self._conn.commit()
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
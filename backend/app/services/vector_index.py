@@ -0,0 +1,182 @@
+import math
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+
+SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit
+}
+PQ_MIN_TRAINING_POINTS = 39 * 256
+
+class VectorIndexBuilder:
+    """Builds course FAISS indexes, picking the index type from the corpus size.
+
+    Vectors can optionally be stored compressed (fp16 / sq8 scalar quantization
+    or PQ codes) and PCA-reduced; the PCA is baked into the index as a
+    pre-transform so queries are projected automatically. Every index is
+    wrapped in IndexIDMap2 so vector IDs stay stable across incremental adds
+    regardless of the underlying type.
+    """
+
+    def __init__(self):
+        self.index_type = settings.VECTOR_INDEX_TYPE
+        self.flat_max = settings.VECTOR_INDEX_FLAT_MAX
+        self.hnsw_max = settings.VECTOR_INDEX_HNSW_MAX
+        self.hnsw_m = settings.VECTOR_INDEX_HNSW_M
+        self.hnsw_ef_construction = settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION
+        self.hnsw_ef_search = settings.VECTOR_INDEX_HNSW_EF_SEARCH
+        self.ivf_nprobe = settings.VECTOR_INDEX_IVF_NPROBE
+        self.compression = settings.VECTOR_COMPRESSION
+        self.pq_m = settings.VECTOR_PQ_M
+        self.pca_dim = settings.VECTOR_PCA_DIM
+
+    def choose_type(self, num_vectors: int) -> str:
+        """Resolve "auto" to flat / hnsw / ivf for a corpus of num_vectors"""
+        if self.index_type != "auto":
+            return self.index_type
+        if num_vectors <= self.flat_max:
+            return "flat"
+        if num_vectors <= self.hnsw_max:
+            return "hnsw"
+        return "ivf"
+
+    def resolve(self, num_vectors: int, dimension: int, compression: str = None, pca_dim: int = None) -> Tuple[str, int]:
+        """The (compression, pca_dim) a build of num_vectors would actually use, after fallbacks"""
+        compression = self.compression if compression is None else compression
+        pca_dim = self.pca_dim if pca_dim is None else pca_dim
+        if pca_dim and pca_dim < dimension and num_vectors >= pca_dim:
+            dimension = pca_dim
+        else:
+            pca_dim = 0
+        # PQ needs enough points to train 256 centroids per sub-quantizer
+        if compression == "pq" and (num_vectors < PQ_MIN_TRAINING_POINTS or dimension % self.pq_m != 0):
+            compression = "sq8"
+        return compression, pca_dim
+
+    def build(self, vectors: np.ndarray, ids: np.ndarray, index_type: str = None, compression: str = None, pca_dim: int = None):
+        """Create, train (if needed) and fill an index; returns (index, description)"""
+        num_vectors, dimension = vectors.shape
+        index_type = index_type or self.choose_type(num_vectors)
+        compression, pca_dim = self.resolve(num_vectors, dimension, compression, pca_dim)
+
+        transform = None
+        train_vectors = vectors
+        if pca_dim:
+            transform = self._train_pca(vectors, pca_dim)
+            train_vectors = transform.apply(np.ascontiguousarray(vectors, dtype="float32"))
+            dimension = pca_dim
+
+        base = self._new_index(index_type, compression, dimension, num_vectors)
+        if not base.is_trained:
+            base.train(train_vectors)
+
+        if transform is not None:
+            base = faiss.IndexPreTransform(transform, base)
+            base.is_trained = True
+
+        index = faiss.IndexIDMap2(base)
+        index.add_with_ids(vectors, ids)
+        return index, {
+            "index_type": index_type,
+            "compression": compression,
+            "pca_dim": pca_dim
+        }
+
+    def _new_index(self, index_type: str, compression: str, dimension: int, num_vectors: int):
+        quantizer_type = SCALAR_QUANTIZERS.get(compression)
+
+        if index_type == "hnsw":
+            if compression == "pq":
+                base = faiss.IndexHNSWPQ(dimension, self.pq_m, self.hnsw_m)
+            elif quantizer_type is not None:
+                base = faiss.IndexHNSWSQ(dimension, quantizer_type, self.hnsw_m)
+            else:
+                base = faiss.IndexHNSWFlat(dimension, self.hnsw_m)
+            base.hnsw.efConstruction = self.hnsw_ef_construction
+            base.hnsw.efSearch = self.hnsw_ef_search
+            return base
+
+        if index_type == "ivf":
+            nlist = self._ivf_nlist(num_vectors)
+            quantizer = faiss.IndexFlatL2(dimension)
+            if compression == "pq":
+                base = faiss.IndexIVFPQ(quantizer, dimension, nlist, self.pq_m, 8)
+            elif quantizer_type is not None:
+                base = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, quantizer_type)
+            else:
+                base = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            base.nprobe = self.ivf_nprobe
+            return base
+
+        if compression == "pq":
+            # IndexPQ rejects ID selectors; a single-list IVFPQ is the same exhaustive PQ scan
+            base = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, 1, self.pq_m, 8)
+            base.nprobe = 1
+            return base
+        if quantizer_type is not None:
+            return faiss.IndexScalarQuantizer(dimension, quantizer_type)
+        return faiss.IndexFlatL2(dimension)
+
+    def _train_pca(self, vectors: np.ndarray, pca_dim: int):
+        """Fit PCA with scikit-learn and express it as a FAISS transform so queries get it too"""
+        from sklearn.decomposition import PCA
+
+        pca = PCA(n_components=pca_dim, random_state=0).fit(vectors)
+        components = pca.components_.astype("float32")
+        bias = -(components @ pca.mean_.astype("float32"))
+
+        transform = faiss.LinearTransform(vectors.shape[1], pca_dim, True)
+        faiss.copy_array_to_vector(components.ravel(), transform.A)
+        faiss.copy_array_to_vector(bias.astype("float32"), transform.b)
+        transform.is_trained = True
+        return transform
+
+    def _ivf_nlist(self, num_vectors: int) -> int:
+        # ~4*sqrt(n) lists, with at least 39 training points per centroid
+        return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+    def search_params(self, index, sel=None) -> Optional[faiss.SearchParameters]:
+        """Per-query search parameters (selector, nprobe / efSearch) for an index"""
+        base = index
+        while isinstance(base, (faiss.IndexIDMap2, faiss.IndexIDMap, faiss.IndexPreTransform)):
+            base = faiss.downcast_index(base.index)
+        if isinstance(base, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = self.ivf_nprobe
+        elif isinstance(base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = self.hnsw_ef_search
+        elif sel is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        # The caller must keep sel alive until the search returns
+        if sel is not None:
+            params.sel = sel
+        return params
+
+    def measure_recall(self, index, vectors: np.ndarray, ids: np.ndarray, k: int = 10, sample: int = 100) -> Dict:
+        """Recall@k of index against exact (Flat) search, using stored vectors as queries"""
+        num_vectors = vectors.shape[0]
+        if num_vectors == 0:
+            return {"recall": 1.0, "k": k, "queries": 0}
+        k = min(k, num_vectors)
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(num_vectors, size=min(sample, num_vectors), replace=False)
+        queries = np.ascontiguousarray(vectors[query_rows], dtype="float32")
+
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+        _, exact_rows = exact.search(queries, k)
+        _, approx_ids = index.search(queries, k, params=self.search_params(index))
+
+        hits = 0
+        for expected, found in zip(ids[exact_rows], approx_ids):
+            hits += len(set(expected.tolist()) & set(found.tolist()))
+        return {"recall": hits / (len(query_rows) * k), "k": k, "queries": len(query_rows)}
+
+vector_index_builder = VectorIndexBuilder()
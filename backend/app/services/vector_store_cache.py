@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+class VectorStoreCache:
+    """Bounded LRU cache of loaded vector stores keyed by vector_store_id.
+
+    Each entry remembers the version stamp of the files it was loaded from so
+    a store that was rewritten on disk (by this worker or another one) is
+    reloaded on the next lookup instead of serving stale vectors.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str, version: Any) -> Optional[Any]:
+        """Return the cached value if it was loaded from files with this version stamp"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["version"] != version:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key: str, value: Any, version: Any, size: int):
+        """Insert a value, evicting least recently used entries to stay in budget"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # Too large to ever fit; serve it uncached rather than flushing everything
+                return
+            self._entries[key] = {"value": value, "version": version, "size": size}
+            self._current_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._current_bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_load(self, key: str, version: Any, loader: Callable[[], Tuple[Any, int]]) -> Any:
+        """Return the cached value or call loader() -> (value, size) and cache it"""
+        value = self.get(key, version)
+        if value is not None:
+            return value
+        value, size = loader()
+        self.put(key, value, version, size)
+        return value
+
+    def invalidate(self, key: str):
+        """Drop a single entry, e.g. after its store was rewritten"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._current_bytes -= entry["size"]
+
+vector_store_cache = VectorStoreCache(
+    max_entries=settings.VECTOR_STORE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.VECTOR_STORE_CACHE_MAX_BYTES
+)
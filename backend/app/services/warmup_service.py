@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.analytics import CourseAnalytics
+from app.services.ollama_service import ollama_service
+from app.services.rag_service import rag_service
+from app.services.blocking_executor import blocking_executor
+from app.services.context_builder import context_builder
+from app.services.document_parser import warm_up as warm_up_parser
+
+class WarmupService:
+    """Startup warm-up so the first requests after a deploy don't pay for cold starts.
+
+    Loads the indexes of the most active courses into the vector store cache,
+    makes Ollama load the chat and embedding models, starts the parsing
+    processes and loads the tokenizer. The app reports ready once this is done.
+    """
+
+    def __init__(self):
+        self.enabled = settings.WARMUP_ENABLED
+        self.num_courses = settings.WARMUP_COURSES
+        self.ready = not self.enabled
+        self.status: Dict = {"stage": "pending" if self.enabled else "disabled"}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self.ready = False
+            self.status = {"stage": "running"}
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _hot_course_ids(self) -> List[int]:
+        db = SessionLocal()
+        try:
+            rows = db.query(CourseAnalytics.course_id).filter(
+                CourseAnalytics.ai_interactions > 0
+            ).order_by(CourseAnalytics.ai_interactions.desc()).limit(self.num_courses).all()
+            return [row.course_id for row in rows]
+        finally:
+            db.close()
+
+    async def _preload_courses(self) -> Dict:
+        course_ids = await blocking_executor.run(self._hot_course_ids)
+        loaded = []
+        for course_id in course_ids:
+            try:
+                await blocking_executor.run(rag_service.load_vector_store, rag_service.course_store_id(course_id))
+                loaded.append(course_id)
+            except (FileNotFoundError, ValueError):
+                continue
+        return {"candidates": len(course_ids), "loaded": loaded}
+
+    async def run(self):
+        started = time.perf_counter()
+        try:
+            # One no-op per worker so every parsing process is spawned now
+            parser_tasks = [
+                blocking_executor.run_parse(warm_up_parser)
+                for _ in range(max(1, blocking_executor.parse_processes))
+            ]
+            courses, models, _, *parsers = await asyncio.gather(
+                self._preload_courses(),
+                ollama_service.warm_up(),
+                blocking_executor.run(context_builder.count_tokens, "warm-up"),
+                *parser_tasks
+            )
+            self.status = {"stage": "done", "courses": courses, "models": models, "parser_workers": len(parsers)}
+        except Exception as e:
+            # Serve anyway; a failed warm-up only means slower first requests
+            print(f"Warm-up failed: {str(e)}")
+            self.status = {"stage": "failed", "error": str(e)}
+        self.status["duration_seconds"] = round(time.perf_counter() - started, 3)
+        self.ready = True
+        print(f"Warm-up finished: {self.status}")
+
+warmup_service = WarmupService()
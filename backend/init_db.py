@@ -9,6 +9,7 @@ from app.models.quiz import Quiz, QuizQuestion, QuizAttempt, QuizAnswer
 from app.models.analytics import UserAnalytics, CourseAnalytics
 from app.models.assignment import Assignment, AssignmentSubmission
 from app.models.moderation import ModerationSettings, ModerationLog
+from app.models.ingestion import IngestionJob
 
 def init_db():
     """Initialize database tables"""
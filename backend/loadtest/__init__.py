@@ -0,0 +1 @@
+"""Offline performance tooling: a fake Ollama server and a load-test driver (see README.md)"""
@@ -0,0 +1,285 @@
+"""
+Fake Ollama server for benchmarks and local development without a GPU or network.
+
+Implements the parts of the Ollama API the backend uses (/api/generate,
+/api/chat, /api/embeddings, /api/embed, /api/version, /api/tags) with:
+- deterministic embeddings (hashed bag of words, so texts sharing words are similar)
+- canned answers, and valid quiz JSON for format="json" requests
+- tunable latency: prompt and generation throughput, a one-off model load,
+  a limited number of parallel generation slots and an error rate
+- the token counts and durations real Ollama reports
+
+Usage (from the backend directory):
+    python -m loadtest.fake_ollama --port 11435 --tokens-per-second 30 --slots 2
+then start the backend with OLLAMA_BASE_URL=http://localhost:11435
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_SENTENCES = [
+    "Based on the course materials, this concept builds on the definitions introduced earlier.",
+    "The key idea is to relate each term to the examples discussed in the lecture notes.",
+    "In practice, you would apply it step by step and check the result against the rules.",
+    "The materials also point out a common mistake: skipping the assumptions.",
+    "To review, compare it with the related topics covered in the same chapter.",
+    "This is usually assessed with short worked problems in the quizzes."
+]
+
+class FakeOllama:
+    def __init__(
+        self,
+        dim: int = 768,
+        prompt_tokens_per_second: float = 2000.0,
+        tokens_per_second: float = 30.0,
+        answer_tokens: int = 120,
+        load_ms: float = 0.0,
+        embed_ms: float = 2.0,
+        slots: int = 1,
+        error_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.dim = dim
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.load_seconds = load_ms / 1000
+        self.embed_seconds = embed_ms / 1000
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        # Like OLLAMA_NUM_PARALLEL: generations beyond this wait for a slot
+        self._slots = asyncio.Semaphore(slots)
+        self._loaded: set = set()
+        self.requests = {"generate": 0, "chat": 0, "embed": 0, "errors": 0}
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return max(1, len(text) // 4)
+
+    def embed_text(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype="float32")
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def answer(self, prompt: str) -> str:
+        digest = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "little")
+        words: List[str] = []
+        i = digest
+        while len(words) < self.answer_tokens:
+            words.extend(ANSWER_SENTENCES[i % len(ANSWER_SENTENCES)].split())
+            i += 1
+        return " ".join(words[:self.answer_tokens])
+
+    @staticmethod
+    def quiz(prompt: str) -> str:
+        match = re.search(r"EXACTLY (\d+)", prompt)
+        count = int(match.group(1)) if match else 5
+        match = re.search(r"Difficulty level: (\w+)", prompt)
+        difficulty = match.group(1) if match else "medium"
+        questions = []
+        for n in range(1, count + 1):
+            options = [f"Option {letter} for question {n}" for letter in "ABCD"]
+            questions.append({
+                "question_text": f"Which statement about concept {n} matches the course material?",
+                "question_type": "multiple_choice",
+                "options": options,
+                "correct_answer": options[n % 4],
+                "explanation": f"The material describes concept {n} this way.",
+                "difficulty": difficulty
+            })
+        return json.dumps({"questions": questions})
+
+    def should_fail(self) -> bool:
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.requests["errors"] += 1
+            return True
+        return False
+
+    async def load(self, model: str) -> float:
+        """Simulate loading the model on its first use; returns the load time"""
+        if model in self._loaded or not self.load_seconds:
+            self._loaded.add(model)
+            return 0.0
+        await asyncio.sleep(self.load_seconds)
+        self._loaded.add(model)
+        return self.load_seconds
+
+    def timings(self, load: float, prompt_tokens: int, prompt_eval: float, completion_tokens: int, eval_seconds: float, started: float) -> Dict:
+        return {
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_eval * 1e9),
+            "eval_count": completion_tokens,
+            "eval_duration": int(eval_seconds * 1e9)
+        }
+
+def create_app(fake: FakeOllama) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+
+    def now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def error() -> JSONResponse:
+        return JSONResponse(status_code=500, content={"error": "simulated failure"})
+
+    async def complete(model: str, prompt_text: str, output: str):
+        """Run a generation in a slot; yields (token, timings-or-None) so chat can stream"""
+        started = time.perf_counter()
+        async with fake._slots:
+            load = await fake.load(model)
+            prompt_tokens = fake.count_tokens(prompt_text)
+            prompt_eval = prompt_tokens / fake.prompt_tokens_per_second
+            await asyncio.sleep(prompt_eval)
+            words = output.split(" ")
+            eval_started = time.perf_counter()
+            for i, word in enumerate(words):
+                await asyncio.sleep(1 / fake.tokens_per_second)
+                yield (word if i == 0 else " " + word), None
+            timings = fake.timings(load, prompt_tokens, prompt_eval, len(words), time.perf_counter() - eval_started, started)
+            yield "", timings
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model} for model in sorted(fake._loaded)]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        started = time.perf_counter()
+        if not body.get("prompt"):
+            # An empty prompt only loads the model
+            load = await fake.load(model)
+            return {
+                "model": model,
+                "created_at": now(),
+                "response": "",
+                "done": True,
+                "done_reason": "load",
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "load_duration": int(load * 1e9)
+            }
+        fake.requests["generate"] += 1
+        if fake.should_fail():
+            return error()
+        prompt = body["prompt"]
+        output = fake.quiz(prompt) if body.get("format") == "json" else fake.answer(prompt)
+        text = ""
+        async for piece, timings in complete(model, (body.get("system") or "") + prompt, output):
+            text += piece
+        return {"model": model, "created_at": now(), "response": text, "done": True, "done_reason": "stop", **timings}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        fake.requests["chat"] += 1
+        if fake.should_fail():
+            return error()
+        messages = body.get("messages", [])
+        prompt = "\n".join(message.get("content", "") for message in messages)
+        last = messages[-1].get("content", "") if messages else ""
+        output = fake.answer(last)
+
+        if body.get("stream", True):
+            async def lines():
+                async for piece, timings in complete(model, prompt, output):
+                    if timings is None:
+                        yield json.dumps({"model": model, "created_at": now(), "message": {"role": "assistant", "content": piece}, "done": False}) + "\n"
+                    else:
+                        yield json.dumps({"model": model, "created_at": now(), "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop", **timings}) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        text = ""
+        async for piece, timings in complete(model, prompt, output):
+            text += piece
+        return {"model": model, "created_at": now(), "message": {"role": "assistant", "content": text}, "done": True, "done_reason": "stop", **timings}
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fake.requests["embed"] += 1
+        if fake.should_fail():
+            return error()
+        await fake.load(body.get("model", ""))
+        await asyncio.sleep(fake.embed_seconds)
+        return {"embedding": fake.embed_text(body.get("prompt", ""))}
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        fake.requests["embed"] += 1
+        if fake.should_fail():
+            return error()
+        started = time.perf_counter()
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        load = await fake.load(body.get("model", ""))
+        await asyncio.sleep(fake.embed_seconds * len(texts))
+        return {
+            "model": body.get("model", ""),
+            "embeddings": [fake.embed_text(text) for text in texts],
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": sum(fake.count_tokens(text) for text in texts)
+        }
+
+    @app.get("/fake/stats")
+    async def stats():
+        return fake.requests
+
+    return app
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension (nomic-embed-text: 768)")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--tokens-per-second", type=float, default=30.0, help="generation speed per request")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="length of chat and generate answers")
+    parser.add_argument("--load-ms", type=float, default=0.0, help="one-off delay the first time each model is used")
+    parser.add_argument("--embed-ms", type=float, default=2.0, help="delay per embedded text")
+    parser.add_argument("--slots", type=int, default=1, help="parallel generations, like OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama(
+        dim=args.dim,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        load_ms=args.load_ms,
+        embed_ms=args.embed_ms,
+        slots=args.slots,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Load-test driver: replays a student / teacher / admin traffic mix against a
+running backend and reports latency percentiles per route.
+
+Setup goes through the public API, so it works against any deployment with a
+fresh database: it signs up an admin, a teacher and students, creates a
+course, uploads generated materials, waits for indexing and enrolls the
+students. Then virtual users pick a role by weight and run that role's
+requests until the duration is over.
+
+Usage (from the backend directory, with the backend pointed at a fake Ollama):
+    python -m loadtest.fake_ollama --port 11435 &
+    OLLAMA_BASE_URL=http://localhost:11435 uvicorn app.main:app --port 8000 &
+    python -m loadtest.run --base-url http://localhost:8000 --users 20 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+PASSWORD = "LoadTest#2025"
+# Setup requests in flight at once; the default SQLAlchemy pool allows 5 (+10 overflow) connections
+SETUP_CONCURRENCY = 5
+
+TOPICS = [
+    "photosynthesis", "mitochondria", "enzymes", "osmosis", "genetics",
+    "ecosystems", "evolution", "proteins", "respiration", "cell division"
+]
+
+QUESTION_TEMPLATES = [
+    "What is {topic}?",
+    "Explain {topic} in simple terms",
+    "How does {topic} relate to the rest of the course?",
+    "Give an example of {topic}",
+    "What are the common mistakes about {topic}?"
+]
+
+ROLE_WEIGHTS = {"student": 85, "teacher": 12, "admin": 3}
+
+def material_text(index: int, paragraphs: int) -> str:
+    """Deterministic course text: each paragraph is about one topic"""
+    rng = random.Random(index)
+    lines = []
+    for p in range(paragraphs):
+        topic = TOPICS[(index + p) % len(TOPICS)]
+        other = rng.choice(TOPICS)
+        lines.append(
+            f"Section {p + 1}: {topic}. {topic.capitalize()} is a core idea of this unit. "
+            f"It is defined in terms of structure and function, and it is linked to {other}. "
+            f"Students should be able to describe {topic}, give an example of {topic} and "
+            f"explain how {topic} differs from {other}. A common mistake is to confuse the two."
+        )
+    return "\n\n".join(lines)
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class Stats:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.first_byte: Dict[str, List[float]] = {}
+
+    def add(self, route: str, seconds: float, status: str, first_byte: Optional[float] = None):
+        self.samples.setdefault(route, []).append(seconds)
+        route_statuses = self.statuses.setdefault(route, {})
+        route_statuses[status] = route_statuses.get(status, 0) + 1
+        if first_byte is not None:
+            self.first_byte.setdefault(route, []).append(first_byte)
+
+    def report(self, elapsed: float) -> Dict:
+        routes = {}
+        for route in sorted(self.samples):
+            values = sorted(self.samples[route])
+            statuses = self.statuses[route]
+            ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+            routes[route] = {
+                "requests": len(values),
+                "errors": len(values) - ok,
+                "statuses": statuses,
+                "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(1000 * sum(values) / len(values), 1),
+                **{f"p{q}_ms": round(1000 * percentile(values, q), 1) for q in (50, 95, 99)}
+            }
+            if route in self.first_byte:
+                first_byte = sorted(self.first_byte[route])
+                routes[route]["first_byte_p50_ms"] = round(1000 * percentile(first_byte, 50), 1)
+                routes[route]["first_byte_p95_ms"] = round(1000 * percentile(first_byte, 95), 1)
+        return {"duration_seconds": round(elapsed, 1), "routes": routes}
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/")
+        self.stats = Stats()
+        self.rng = random.Random(args.seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.admin: Dict = {}
+        self.teacher: Dict = {}
+        self.students: List[Dict] = []
+        self.course_id: Optional[int] = None
+        self.material_ids: List[int] = []
+        self.questions = [template.format(topic=topic) for topic in TOPICS for template in QUESTION_TEMPLATES]
+
+    # Setup
+
+    async def signup(self, client: httpx.AsyncClient, role: str, name: str) -> Dict:
+        payload = {
+            "email": f"{name}-{self.run_id}@loadtest.example.com",
+            "password": PASSWORD,
+            "full_name": f"Load test {name}",
+            "role": role
+        }
+        if role == "student":
+            payload.update({"semester": 1, "degree_type": "BS"})
+        response = await client.post("/auth/signup", json=payload)
+        response.raise_for_status()
+        data = response.json()
+        return {"id": data["user"]["id"], "headers": {"Authorization": f"Bearer {data['access_token']}"}}
+
+    async def setup(self, client: httpx.AsyncClient):
+        print(f"Setting up run {self.run_id}: 1 admin, 1 teacher, {self.args.students} students")
+        self.admin = await self.signup(client, "admin", "admin")
+        self.teacher = await self.signup(client, "teacher", "teacher")
+        semaphore = asyncio.Semaphore(SETUP_CONCURRENCY)
+
+        async def limited(request: Callable[[], Awaitable]):
+            async with semaphore:
+                return await request()
+
+        self.students = list(await asyncio.gather(*(
+            limited(lambda i=i: self.signup(client, "student", f"student{i}")) for i in range(self.args.students)
+        )))
+
+        response = await client.post(
+            "/courses/",
+            json={"title": f"Load test course {self.run_id}", "description": "Generated", "teacher_id": self.teacher["id"]},
+            headers=self.admin["headers"]
+        )
+        response.raise_for_status()
+        self.course_id = response.json()["id"]
+
+        jobs = []
+        for i in range(self.args.materials):
+            response = await client.post(
+                f"/courses/{self.course_id}/materials",
+                data={"title": f"Unit {i + 1}"},
+                files={"file": (f"unit{i + 1}.txt", material_text(i, self.args.paragraphs).encode("utf-8"), "text/plain")},
+                headers=self.teacher["headers"]
+            )
+            response.raise_for_status()
+            material = response.json()
+            self.material_ids.append(material.get("material_id") or material.get("id"))
+            jobs.append(material["job_id"])
+        await self.wait_for_jobs(client, jobs)
+
+        async def enroll(student: Dict):
+            response = await client.post(
+                "/courses/enroll",
+                json={"student_id": student["id"], "course_id": self.course_id},
+                headers=self.admin["headers"]
+            )
+            response.raise_for_status()
+
+        await asyncio.gather(*(limited(lambda student=student: enroll(student)) for student in self.students))
+
+    async def wait_for_jobs(self, client: httpx.AsyncClient, jobs: List[int]):
+        started = time.perf_counter()
+        pending = set(jobs)
+        while pending:
+            for job_id in list(pending):
+                response = await client.get(f"/courses/ingestion-jobs/{job_id}", headers=self.teacher["headers"])
+                job = response.json()
+                if job["status"] == "failed":
+                    raise RuntimeError(f"Indexing job {job_id} failed: {job.get('error')}")
+                if job["status"] == "completed":
+                    pending.discard(job_id)
+            if pending:
+                if time.perf_counter() - started > self.args.setup_timeout:
+                    raise RuntimeError(f"Indexing did not finish within {self.args.setup_timeout}s")
+                await asyncio.sleep(0.5)
+        print(f"Indexed {len(jobs)} materials in {time.perf_counter() - started:.1f}s")
+
+    # Traffic
+
+    def pick_question(self) -> str:
+        # A few popular questions and a long tail, as in a real class
+        index = min(int(self.rng.paretovariate(1.2)) - 1, len(self.questions) - 1)
+        return self.questions[index]
+
+    async def timed(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.stats.add(route, time.perf_counter() - started, status)
+
+    async def stream(self, client: httpx.AsyncClient, route: str, url: str, **kwargs):
+        """Time a server-sent-events request to its first event and to its end"""
+        started = time.perf_counter()
+        first_byte = None
+        try:
+            async with client.stream("POST", url, **kwargs) as response:
+                status = str(response.status_code)
+                async for _ in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.stats.add(route, time.perf_counter() - started, status, first_byte)
+
+    def student_actions(self, student: Dict) -> List[Tuple[int, Callable]]:
+        headers = student["headers"]
+        course_id = self.course_id
+
+        def query(client):
+            return self.timed(client, "POST /rag/query", "POST", "/rag/query", headers=headers,
+                              json={"query": self.pick_question(), "course_id": course_id})
+
+        def query_stream(client):
+            return self.stream(client, "POST /rag/query/stream", "/rag/query/stream", headers=headers,
+                               json={"query": self.pick_question(), "course_id": course_id})
+
+        def follow_up(client):
+            first = self.pick_question()
+            history = [{"role": "user", "content": first}, {"role": "assistant", "content": "See the course notes."}]
+            return self.timed(client, "POST /rag/query (history)", "POST", "/rag/query", headers=headers,
+                              json={"query": "Can you explain that again?", "course_id": course_id, "conversation_history": history})
+
+        def courses(client):
+            return self.timed(client, "GET /courses/", "GET", "/courses/", headers=headers)
+
+        def quizzes(client):
+            return self.timed(client, "GET /quiz/course/{id}", "GET", f"/quiz/course/{course_id}", headers=headers)
+
+        return [(35, query), (30, query_stream), (10, follow_up), (15, courses), (10, quizzes)]
+
+    def teacher_actions(self) -> List[Tuple[int, Callable]]:
+        headers = self.teacher["headers"]
+        course_id = self.course_id
+
+        def generate_quiz(client):
+            payload = {
+                "course_id": course_id,
+                "topic": self.rng.choice(TOPICS),
+                "difficulty": self.rng.choice(["easy", "medium", "hard"]),
+                "num_questions": 5
+            }
+            if self.rng.random() < 0.5:
+                payload["material_ids"] = [self.rng.choice(self.material_ids)]
+            return self.timed(client, "POST /quiz/generate", "POST", "/quiz/generate", headers=headers, json=payload)
+
+        def students(client):
+            return self.timed(client, "GET /courses/{id}/students", "GET", f"/courses/{course_id}/students", headers=headers)
+
+        def analytics(client):
+            return self.timed(client, "GET /analytics/course/{id}", "GET", f"/analytics/course/{course_id}", headers=headers)
+
+        def query(client):
+            return self.timed(client, "POST /rag/query", "POST", "/rag/query", headers=headers,
+                              json={"query": self.pick_question(), "course_id": course_id})
+
+        return [(30, generate_quiz), (25, students), (25, analytics), (20, query)]
+
+    def admin_actions(self) -> List[Tuple[int, Callable]]:
+        headers = self.admin["headers"]
+
+        def system(client):
+            return self.timed(client, "GET /analytics/system", "GET", "/analytics/system", headers=headers)
+
+        def cache_stats(client):
+            return self.timed(client, "GET /rag/cache/stats", "GET", "/rag/cache/stats", headers=headers)
+
+        def metrics(client):
+            return self.timed(client, "GET /rag/ollama/metrics", "GET", "/rag/ollama/metrics", headers=headers)
+
+        return [(40, system), (30, cache_stats), (30, metrics)]
+
+    async def virtual_user(self, client: httpx.AsyncClient, deadline: float):
+        roles = list(self.args.mix)
+        weights = [self.args.mix[role] for role in roles]
+        while time.perf_counter() < deadline:
+            role = self.rng.choices(roles, weights)[0]
+            if role == "student":
+                actions = self.student_actions(self.rng.choice(self.students))
+            elif role == "teacher":
+                actions = self.teacher_actions()
+            else:
+                actions = self.admin_actions()
+            action = self.rng.choices([fn for _, fn in actions], [weight for weight, _ in actions])[0]
+            await action(client)
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+
+    async def run(self) -> Dict:
+        limits = httpx.Limits(max_connections=self.args.users + 10)
+        timeout = httpx.Timeout(self.args.timeout)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            await self.setup(client)
+            print(f"Running {self.args.users} virtual users for {self.args.duration}s (mix: {self.args.mix})")
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(*(self.virtual_user(client, deadline) for _ in range(self.args.users)))
+            return self.stats.report(time.perf_counter() - started)
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        role, _, weight = part.partition("=")
+        if role not in ROLE_WEIGHTS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid mix entry {part!r}; expected e.g. student=85,teacher=12,admin=3")
+        mix[role] = int(weight)
+    return mix
+
+def print_report(report: Dict):
+    header = f"{'route':<32}{'reqs':>7}{'errors':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for route, row in report["routes"].items():
+        print(f"{route:<32}{row['requests']:>7}{row['errors']:>8}{row['rps']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+        if "first_byte_p50_ms" in row:
+            print(f"{'  first event':<32}{'':>23}{row['first_byte_p50_ms']:>10}{row['first_byte_p95_ms']:>10}")
+    print(f"\nDuration: {report['duration_seconds']}s")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay a student / teacher / admin traffic mix and report per-route latency")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of traffic after setup")
+    parser.add_argument("--mix", type=parse_mix, default=dict(ROLE_WEIGHTS), help="role weights, e.g. student=85,teacher=12,admin=3")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="mean pause between a user's requests; 0 for none")
+    parser.add_argument("--students", type=int, default=50, help="student accounts to create")
+    parser.add_argument("--materials", type=int, default=3, help="materials to upload")
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per material")
+    parser.add_argument("--timeout", type=float, default=180.0, help="per-request timeout in seconds")
+    parser.add_argument("--setup-timeout", type=float, default=300.0, help="seconds to wait for indexing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Script to rebuild vector stores in the consolidated per-course segment layout
+Run this once after upgrading from per-material course_{id}_{title}.index stores,
+from stores whose chunk metadata was pickled (*_metadata.pkl), or from
+single-file stores without tombstone support
+"""
+import asyncio
+import json
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.course import CourseMaterial
+from app.services.course_store import STORE_FORMAT
+from app.services.rag_service import rag_service
+
+async def migrate():
+    """Re-index every material into its course store and remove legacy files"""
+    # Pickled stores can't be upgraded in place; remove them and rebuild from the uploads.
+    # Chunk embeddings come from the embedding cache, so this doesn't re-embed everything.
+    vector_store_path = Path(settings.VECTOR_STORE_PATH)
+    for legacy_metadata_path in vector_store_path.glob("course_*_metadata.pkl"):
+        store_id = legacy_metadata_path.name[:-len("_metadata.pkl")]
+        legacy_index_path = vector_store_path / f"{store_id}.index"
+        if legacy_index_path.exists():
+            legacy_index_path.unlink()
+        legacy_metadata_path.unlink()
+        print(f"Removed legacy store {store_id}")
+    
+    for metadata_path in vector_store_path.glob("course_*_metadata.json"):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get("format") == STORE_FORMAT:
+                continue
+        store_id = metadata_path.name[:-len("_metadata.json")]
+        for path in [
+            vector_store_path / f"{store_id}.index",
+            metadata_path,
+            *vector_store_path.glob(f"{store_id}_*.chunks"),
+            *vector_store_path.glob(f"{store_id}_*.vectors.npy")
+        ]:
+            path.unlink()
+        print(f"Removed old-layout store {store_id}")
+    
+    db = SessionLocal()
+    try:
+        materials = db.query(CourseMaterial).order_by(CourseMaterial.id).all()
+        print(f"Re-indexing {len(materials)} materials...")
+        
+        for material in materials:
+            try:
+                material.vector_store_id = await rag_service.create_vector_store(
+                    course_id=material.course_id,
+                    file_path=material.file_path,
+                    material_title=material.title,
+                    material_id=material.id
+                )
+                db.commit()
+                print(f"✅ {material.title} -> {material.vector_store_id}")
+            except Exception as e:
+                db.rollback()
+                print(f"❌ Failed to index {material.title}: {str(e)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())